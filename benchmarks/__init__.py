@@ -0,0 +1,17 @@
+import json
+from os import path
+
+data_path = path.join(path.dirname(path.dirname(path.realpath(__file__))), 'examples', 'data')
+
+
+def load_docs(n=None, filename='10E.json'):
+    """
+    Loads the bodies of the example news articles,
+    repeated as needed to get `n` docs.
+    """
+    with open(path.join(data_path, filename), 'r') as f:
+        data = json.load(f)
+    docs = [a['body'] for e in data for a in e['articles']]
+    if n is not None:
+        docs = (docs * (n//len(docs) + 1))[:n]
+    return docs
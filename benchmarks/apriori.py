@@ -0,0 +1,79 @@
+"""
+Benchmarks frequent set mining for `AprioriTokenizer`
+over corpus size and `min_sup`, comparing the tid-list (Eclat) miner
+against the classic level-wise one on smaller corpora.
+
+Transactions are the sets of words of each sentence of the example articles.
+
+    $ python -m benchmarks.apriori
+"""
+
+import re
+from time import time
+from itertools import combinations
+from collections import defaultdict
+from broca.tokenize.keyword import apriori
+from benchmarks import load_docs
+
+sentences = [s for d in load_docs() for s in re.split(r'(?<=\.)\s+', d)]
+transactions = [set(re.findall(r'[a-z]+', s.lower())) for s in sentences if s]
+
+
+# The classic, level-wise version, which `AprioriTokenizer` used before
+
+def filter_support(candidates, transactions, min_sup):
+    """
+    Filter candidates to a frequent set by some minimum support.
+    """
+    counts = defaultdict(lambda: 0)
+    for transaction in transactions:
+        for c in (c for c in candidates if set(c).issubset(transaction)):
+            counts[c] += 1
+    return {i for i in candidates if counts[i]/len(transactions) >= min_sup}
+
+
+def generate_candidates(freq_set, k):
+    """
+    Generate candidates for an iteration (k >= 2).
+    """
+    single_set = {(i,) for i in set(apriori.flatten(freq_set))}
+    cands = [apriori.flatten(f) for f in combinations(single_set, k)]
+    return [cand for cand in cands if validate_candidate(cand, freq_set, k)]
+
+
+def validate_candidate(candidate, freq_set, k):
+    """
+    Checks if we should keep a candidate.
+    We keep a candidate if all its k-1-sized subsets
+    are present in the frequent sets.
+    """
+    for subcand in combinations(candidate, k-1):
+        if subcand not in freq_set:
+            return False
+    return True
+
+
+def levelwise(transactions, min_sup):
+    freq_set = filter_support({(t,) for tr in transactions for t in tr}, transactions, min_sup)
+    k, last_set = 2, set()
+    while freq_set:
+        last_set = freq_set
+        freq_set = filter_support(generate_candidates(freq_set, k), transactions, min_sup)
+        k += 1
+    return last_set
+
+
+print('{:>8} {:>8} {:>10} {:>12} {:>12}'.format('n', 'min_sup', 'n_sets', 'tid-lists', 'level-wise'))
+for n in [250, 1000, 4000, 16000]:
+    trans = (transactions * (n//len(transactions) + 1))[:n]
+    for min_sup in [0.2, 0.1, 0.05]:
+        s = time()
+        freq_sets = apriori.frequent_sets(trans, min_sup)
+        t = time() - s
+
+        t_ = '-'
+        if n <= 1000:
+            s = time()
+            levelwise(trans, min_sup)
+            t_ = '{:.3f}s'.format(time() - s)
+        print('{:>8} {:>8} {:>10} {:>11.3f}s {:>12}'.format(n, min_sup, len(freq_sets), t, t_))
@@ -0,0 +1,50 @@
+"""
+Compares loading and looking up terms in an IDF model saved
+as JSON against one saved in the binary (memory-mapped) format.
+
+    $ python -m benchmarks.idf
+"""
+
+import os
+import json
+import math
+import random
+import shutil
+import tempfile
+from time import time
+from broca.knowledge.idf import IDF, save_idf
+
+n_terms = 1000000
+n_docs = 10000000
+
+random.seed(0)
+model = {'term{}'.format(i): math.log(n_docs/random.randint(1, 10000)) for i in range(n_terms)}
+model['_n_docs'] = n_docs
+queries = ['term{}'.format(random.randint(0, 2*n_terms)) for _ in range(100000)]
+
+dir = tempfile.mkdtemp()
+paths = {
+    'json': os.path.join(dir, 'idf.json'),
+    'binary': os.path.join(dir, 'idf.bin')
+}
+with open(paths['json'], 'w') as f:
+    json.dump(model, f)
+save_idf(model, paths['binary'])
+
+for name, path in paths.items():
+    s = time()
+    idf = IDF(path)
+    t_load = time() - s
+
+    s = time()
+    [idf[q] for q in queries]
+    t_get = time() - s
+
+    s = time()
+    idf.lookup(queries)
+    t_batch = time() - s
+
+    print('{:<8} {:>6.0f}MB on disk, load {:>7.3f}s, {:>6.2f}us/lookup, {:>6.2f}us/lookup batched'.format(
+        name, os.path.getsize(path)/1e6, t_load, t_get/len(queries)*1e6, t_batch/len(queries)*1e6))
+
+shutil.rmtree(dir)
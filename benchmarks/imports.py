@@ -0,0 +1,29 @@
+"""
+Measures how long importing broca's modules takes,
+each in a fresh interpreter.
+
+    $ python -m benchmarks.imports
+"""
+
+import sys
+import time
+import subprocess
+
+imports = [
+    'import broca',
+    'from broca.preprocess import BasicCleaner',
+    'from broca.distance.sift4 import sift4',
+    'from broca.tokenize.keyword import RAKETokenizer',
+    'from broca.vectorize import BoWVectorizer',
+    'from broca.common.shared import spacy; spacy.load()',
+]
+
+n = 5
+
+for stmt in imports:
+    times = []
+    for _ in range(n):
+        s = time.time()
+        subprocess.check_call([sys.executable, '-c', stmt])
+        times.append(time.time() - s)
+    print('{:.3f}s\t{}'.format(min(times), stmt))
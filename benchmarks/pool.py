@@ -0,0 +1,35 @@
+"""
+Compares running RAKE over repeated batches of docs with a fresh joblib pool
+per call (shipping the bound RAKE engine with each doc) against the shared worker pool.
+
+    $ python -m benchmarks.pool
+"""
+
+from time import time
+from joblib import Parallel, delayed
+from broca.common.pool import shared_pool
+from broca.tokenize.keyword.rake import Rake, RAKETokenizer, stops_path
+from benchmarks import load_docs
+
+docs = load_docs(500)
+batches = [docs[i:i+100] for i in range(0, len(docs), 100)]
+n_jobs = 4
+
+
+def joblib_rake(docs):
+    r = Rake.shared(stops_path)
+    return Parallel(n_jobs=n_jobs)(delayed(r.run)(doc) for doc in docs)
+
+
+def bench(name, func):
+    s = time()
+    for batch in batches:
+        func(batch)
+    t = time() - s
+    print('{:<32} {:>8.1f} docs/sec'.format(name, len(docs)/t))
+
+
+bench('joblib, pool per call', joblib_rake)
+bench('shared pool (cold)', RAKETokenizer(n_jobs=n_jobs).tokenize)
+bench('shared pool (warm)', RAKETokenizer(n_jobs=n_jobs).tokenize)
+shared_pool(n_jobs).shutdown()
@@ -0,0 +1,39 @@
+"""
+Benchmarks RAKE keyword extraction over short and long documents.
+
+    $ python -m benchmarks.rake
+"""
+
+import re
+from time import time
+from broca.tokenize.keyword import rake
+from benchmarks import load_docs
+
+articles = load_docs()
+suites = {
+    'short (sentences)': [s for d in articles for s in re.split(r'(?<=\.)\s+', d) if s][:2000],
+    'medium (articles)': articles * 10,
+    'long (all articles)': [' '.join(articles)] * 5
+}
+
+
+def bench(name, func, docs):
+    s = time()
+    for doc in docs:
+        func(doc)
+    t = time() - s
+    print('  {:<28} {:>10.1f} docs/sec'.format(name, len(docs)/t))
+
+
+s = time()
+regex = rake.build_stop_word_regex(rake.stops_path)
+print('Compiling the stop word regex: {:.3f}s (once per process)'.format(time() - s))
+
+alternation = re.compile('|'.join('\\b' + w + '\\b' for w in rake.load_stop_words(rake.stops_path)), re.IGNORECASE)
+engine = rake.Rake.shared(rake.stops_path)
+
+for suite, docs in suites.items():
+    print(suite)
+    bench('Rake.run', engine.run, docs)
+    bench('stop words, trie regex', lambda d: regex.sub('|', d), docs)
+    bench('stop words, alternation', lambda d: alternation.sub('|', d), docs)
@@ -0,0 +1,79 @@
+"""
+Compares counting terms exactly against count-min sketches of a few sizes,
+reporting memory used and error against the exact counts.
+
+The terms are the example corpus' unigrams and bigrams, along with
+a long tail of random phrases (like a keyphrase vocabulary over a web crawl).
+
+    $ python -m benchmarks.sketch
+"""
+
+import re
+import random
+import tracemalloc
+from time import time
+from collections import Counter
+from broca.knowledge.sketch import CountMinSketch
+from benchmarks import load_docs
+
+random.seed(0)
+docs = []
+for doc in load_docs() * 20:
+    toks = re.findall(r'\w+', doc.lower())
+    phrases = [' '.join(random.sample(toks, 3)) for _ in range(len(toks)//2)] if len(toks) >= 3 else []
+    docs.append(Counter(toks + [' '.join(bg) for bg in zip(toks, toks[1:])] + phrases))
+
+k = 100
+
+
+def bench(name, func):
+    tracemalloc.start()
+    s = time()
+    counts = func()
+    t = time() - s
+    size, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return counts, t, size, peak
+
+
+# Like the shards `broca.knowledge.counts.count` adds
+chunks = []
+for i in range(0, len(docs), 100):
+    chunk = Counter()
+    for doc in docs[i:i+100]:
+        chunk.update(doc)
+    chunks.append(chunk)
+
+
+def exact():
+    counts = Counter()
+    for chunk in chunks:
+        counts.update(chunk)
+    return counts
+
+
+def sketched(epsilon):
+    def func():
+        sketch = CountMinSketch(epsilon=epsilon, delta=1e-3, k=k)
+        for chunk in chunks:
+            sketch.add(chunk)
+        return sketch
+    return func
+
+
+counts, t, size, peak = bench('exact', exact)
+terms = list(counts)
+true = [counts[t] for t in terms]
+top = set(t for t, _ in counts.most_common(k))
+total = sum(true)
+print('{} terms, {} occurrences'.format(len(terms), total))
+print('{:<20} {:>6.1f}MB kept {:>6.1f}MB peak {:>6.2f}s'.format('exact', size/1e6, peak/1e6, t))
+
+for epsilon in [1e-3, 1e-4, 1e-5]:
+    sketch, t, size, peak = bench('sketch', sketched(epsilon))
+    errors = [e - c for e, c in zip(sketch.lookup(terms).tolist(), true)]
+    top_errors = [sketch[t] - counts[t] for t in top]
+    recall = len(top & set(sketch.top))/k
+    print('{:<20} {:>6.1f}MB kept {:>6.1f}MB peak {:>6.2f}s  mean error {:>8.2f} (bound {:>6.0f}), top {} mean error {:>6.2f}, recall {:.2f}'.format(
+        'sketch, eps={}'.format(epsilon), size/1e6, peak/1e6, t,
+        sum(errors)/len(errors), epsilon*total, k, sum(top_errors)/k, recall))
@@ -0,0 +1,32 @@
+"""
+Compares annotating docs with spaCy one by one (optionally across processes,
+each loading its own model) against feeding them to the model in batches.
+
+    $ python -m benchmarks.spacy_batch
+"""
+
+from time import time
+from broca.annotate import annotate, annotate_docs
+from broca.common.shared import spacy
+from broca.common.util import parallel
+from benchmarks import load_docs
+
+docs = load_docs(2000)
+
+# Don't count loading the model
+spacy.load()
+
+
+def bench(name, func):
+    s = time()
+    func()
+    t = time() - s
+    print('{:<32} {:>8.1f} docs/sec'.format(name, len(docs)/t))
+
+
+bench('per-doc', lambda: [annotate(doc) for doc in docs])
+bench('per-doc, n_jobs=4', lambda: parallel(annotate, docs, 4))
+for batch_size in [100, 1000]:
+    for n_threads in [1, 2, 4]:
+        bench('batch_size={}, n_threads={}'.format(batch_size, n_threads),
+              lambda: annotate_docs(docs, batch_size=batch_size, n_threads=n_threads))
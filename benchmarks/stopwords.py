@@ -0,0 +1,34 @@
+"""
+Compares the per-token cost of filtering tokens against
+stopword/keyword lists versus the shared frozensets.
+
+    $ python -m benchmarks.stopwords
+"""
+
+import re
+from time import time
+from broca.common.stopwords import stopwords_file
+from benchmarks import load_docs
+
+# One large document
+tokens = re.findall(r'\w+', ' '.join(load_docs()).lower()) * 5
+
+stops = stopwords_file()
+stops_list = sorted(stops)
+
+# Like OverkillTokenizer's keyword unigrams
+kws = [t for t in set(tokens) if t not in stops][:2000]
+kws_set = set(kws)
+
+
+def bench(name, vocab):
+    s = time()
+    kept = [t for t in tokens if t not in vocab]
+    t = time() - s
+    print('{:<24} {:>8.1f} ns/token'.format(name, t/len(tokens)*1e9))
+    return kept
+
+
+print('{} tokens'.format(len(tokens)))
+assert bench('stopwords, list', stops_list) == bench('stopwords, frozenset', stops)
+assert bench('keywords, list', kws) == bench('keywords, set', kws_set)
@@ -0,0 +1,172 @@
+"""
+A shared annotation layer, so that each document is parsed by spaCy only once.
+
+`Annotator` produces `AnnotatedDoc`s, which are the documents themselves
+(they are strings) carrying their tokens, tags, lemmas and entities.
+The spaCy-based pipes (`LemmaTokenizer`, `POSTokenizer`, `OverkillTokenizer`,
+`DCSVectorizer` and `Entities`) reuse these annotations when they're given
+annotated docs, and annotate plain docs themselves otherwise:
+
+    Pipeline(
+        BasicCleaner(),
+        Annotator(),
+        [LemmaTokenizer(), Entities(), DCSVectorizer()]
+    )
+
+Docs are fed to spaCy in batches of `batch_size`, parsed with `n_threads` threads
+(see `annotate_docs`), which is much faster than parsing them one by one and
+doesn't require loading a model in each process, as `n_jobs` does.
+"""
+
+import sys
+from broca import Pipe
+from broca.common.shared import spacy
+from broca.common.lemma import shared_cache
+from broca.common.util import penn_to_wordnet, parallel
+
+
+class AnnotatedDoc(str):
+    """
+    A document along with its annotations:
+
+        - `tokens`: lowercased tokens
+        - `tags`: their Penn Treebank PoS tags
+        - `lemmas`: their WordNet lemmas (or the token itself,
+          if its PoS isn't in WordNet), computed on first access
+          (see `lemmatize`)
+        - `ents`: `(text, label)` for each entity,
+          or `None` if the doc was annotated without entities
+
+    Annotations are stored as tuples, with tags interned.
+    Since it's a string, pipes which don't use the annotations
+    can take it as a regular doc.
+    """
+    def __new__(cls, text, tokens, tags, ents, lemmas=None):
+        obj = super().__new__(cls, text)
+        obj.tokens = tuple(tokens)
+        obj.tags = tuple(sys.intern(t) for t in tags)
+        obj.ents = tuple(ents) if ents is not None else None
+        obj._lemmas = tuple(lemmas) if lemmas is not None else None
+        return obj
+
+    @property
+    def lemmas(self):
+        return self.lemmatize()
+
+    def lemmatize(self, cache=None, skip=None):
+        """
+        Computes the lemmas, unless they already are, using a `LemmaCache`
+        (by default, the one shared by this process).
+
+        If `skip` (e.g. a set of stopwords) is given, only the lemmas
+        of the other tokens are returned, and those of the skipped tokens
+        aren't looked up.
+        """
+        if self._lemmas is not None:
+            if skip is None:
+                return self._lemmas
+            return tuple(lemma for tok, lemma in zip(self.tokens, self._lemmas) if tok not in skip)
+
+        if cache is None:
+            cache = shared_cache()
+        lemmas = tuple(
+            cache.lemmatize(tok, wn_tag) if wn_tag is not None else tok
+            for tok, wn_tag in zip(self.tokens, map(penn_to_wordnet, self.tags))
+            if skip is None or tok not in skip)
+        if skip is None:
+            self._lemmas = lemmas
+        return lemmas
+
+    def __reduce__(self):
+        return (AnnotatedDoc, (str(self), self.tokens, self.tags, self.ents, self._lemmas))
+
+
+class Annotator(Pipe):
+    """
+    Annotates docs with spaCy.
+    If `lemmatize` is True, lemmas are computed up front
+    (so they are frozen along with the rest), with `n_jobs`.
+    Set `entity` to False if no pipe downstream needs entities,
+    to skip recognizing them.
+    """
+    input = Pipe.type.docs
+    output = Pipe.type.docs
+    per_doc = True
+
+    def __init__(self, lemmatize=True, entity=True, n_jobs=1, batch_size=1000, n_threads=2):
+        self.lemmatize = lemmatize
+        self.entity = entity
+        self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.n_threads = n_threads
+
+    def __call__(self, docs):
+        docs = annotate_docs(docs, batch_size=self.batch_size, n_threads=self.n_threads, entity=self.entity)
+        if not self.lemmatize:
+            return docs
+        if self.n_jobs == 1:
+            return [_lemmatize(doc) for doc in docs]
+        else:
+            return parallel(_lemmatize, docs, self.n_jobs, warmup=('wordnet',))
+
+
+def _lemmatize(doc):
+    doc.lemmas
+    return doc
+
+
+def _annotated(doc, entity):
+    return isinstance(doc, AnnotatedDoc) and (doc.ents is not None or not entity)
+
+
+def annotate(doc, entity=False):
+    """
+    Annotates a doc, unless it's already annotated.
+    Entities are only recognized if `entity` is True,
+    since it's slow and most pipes don't need them.
+    """
+    if _annotated(doc, entity):
+        return doc
+    return _from_spacy(doc, spacy(str(doc), tag=True, parse=False, entity=entity), entity)
+
+
+def annotate_docs(docs, batch_size=1000, n_threads=2, entity=False):
+    """
+    Annotates those docs which aren't already annotated
+    (or which are, but without entities, if `entity` is True),
+    feeding them to spaCy in batches of `batch_size`
+    which are parsed with `n_threads` threads.
+    """
+    docs = list(docs)
+    todo = [i for i, doc in enumerate(docs) if not _annotated(doc, entity)]
+    if not todo:
+        return docs
+
+    texts = [str(docs[i]) for i in todo]
+    nlp = spacy.load()
+
+    # Fall back to parsing docs one by one
+    # for spaCy versions without `pipe`
+    if hasattr(nlp, 'pipe'):
+        parsed = nlp.pipe(texts, tag=True, parse=False, entity=entity,
+                          batch_size=batch_size, n_threads=n_threads)
+    else:
+        parsed = (nlp(text, tag=True, parse=False, entity=entity) for text in texts)
+
+    for i, res in zip(todo, parsed):
+        docs[i] = _from_spacy(docs[i], res, entity)
+    return docs
+
+
+def _from_spacy(doc, res, entity):
+    ents = [(e.string, e.label_) for e in res.ents] if entity else None
+
+    # Only the entities were missing
+    if isinstance(doc, AnnotatedDoc):
+        return AnnotatedDoc(str(doc), doc.tokens, doc.tags, ents, doc._lemmas)
+
+    tokens, tags = [], []
+    for t in res:
+        tokens.append(t.lower_.strip())
+        tags.append(t.tag_)
+    return AnnotatedDoc(doc, tokens, tags, ents)
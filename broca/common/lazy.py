@@ -0,0 +1,27 @@
+import sys
+import importlib
+
+
+def lazy_import(module, names):
+    """
+    Defers importing a package's members until they are first accessed,
+    so that importing the package doesn't pull in their (heavy) dependencies.
+
+    `names` maps each member's name to the submodule that defines it.
+    Returns the package's `__getattr__` and `__dir__` functions:
+
+        __getattr__, __dir__ = lazy_import(__name__, {'Foo': '.foo'})
+    """
+    def __getattr__(name):
+        if name not in names:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(module, name))
+        val = getattr(importlib.import_module(names[name], module), name)
+
+        # Cache it so this is only called once per name
+        setattr(sys.modules[module], name, val)
+        return val
+
+    def __dir__():
+        return sorted(set(vars(sys.modules[module])) | set(names))
+
+    return __getattr__, __dir__
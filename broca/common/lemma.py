@@ -0,0 +1,168 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+
+
+class LemmaCache():
+    """
+    A bounded `(token, wordnet tag) -> lemma` cache in front of
+    NLTK's WordNet lemmatizer. Since token frequencies are heavily skewed,
+    most lookups hit a fairly small cache.
+
+    Holds at most `max_size` lemmas (least recently used ones are dropped first).
+    If `path` is set, the cache is loaded from there if it exists, and `save`
+    writes it back.
+
+    If `track_new` is True, lemmas cached since the last `drain` can be
+    collected with it, e.g. to send those cached in a worker process
+    back to the parent's cache (which adds them in with `update`).
+
+    `lemmatizer` is anything with a `lemmatize(token, tag)` method,
+    by default a `WordNetLemmatizer`.
+    """
+    def __init__(self, max_size=100000, path=None, lemmatizer=None, track_new=False):
+        self.max_size = max_size
+        self.path = path
+        self.track_new = track_new
+        self.hits = 0
+        self.misses = 0
+        self._lemmatizer = lemmatizer
+        self._lemmas = OrderedDict()
+        self._new = OrderedDict()
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @property
+    def lemmatizer(self):
+        if self._lemmatizer is None:
+            # Imported here since it's slow to import
+            from nltk.stem.wordnet import WordNetLemmatizer
+            self._lemmatizer = WordNetLemmatizer()
+        return self._lemmatizer
+
+    def lemmatize(self, token, tag):
+        key = (token, tag)
+        lemma = self._lemmas.get(key)
+        if lemma is not None:
+            self.hits += 1
+            try:
+                self._lemmas.move_to_end(key)
+
+            # Dropped by another thread in the meantime
+            except KeyError:
+                pass
+            return lemma
+
+        self.misses += 1
+        lemma = self.lemmatizer.lemmatize(token, tag)
+        self._lemmas[key] = lemma
+        while len(self._lemmas) > self.max_size:
+            self._lemmas.popitem(last=False)
+        if self.track_new:
+            self._new[key] = lemma
+            while len(self._new) > self.max_size:
+                self._new.popitem(last=False)
+        return lemma
+
+    def drain(self):
+        """
+        Returns the `(key, lemma)` items cached since the last call.
+        """
+        new, self._new = self._new, OrderedDict()
+        return list(new.items())
+
+    def update(self, items):
+        """
+        Adds `(key, lemma)` items (e.g. from another cache's `drain`)
+        as the most recent.
+        """
+        for key, lemma in items:
+            self._lemmas[key] = lemma
+            self._lemmas.move_to_end(key)
+        while len(self._lemmas) > self.max_size:
+            self._lemmas.popitem(last=False)
+
+    def __len__(self):
+        return len(self._lemmas)
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return self.hits/lookups if lookups else 0.
+
+    def stats(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hit_rate,
+            'size': len(self),
+            'max_size': self.max_size
+        }
+
+    def clear(self):
+        self._lemmas.clear()
+        self._new.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self, path):
+        """
+        Loads lemmas saved to `path`,
+        keeping those already in the cache as the most recent.
+        """
+        with open(path, 'rb') as f:
+            items = pickle.load(f)
+        lemmas = OrderedDict(items)
+        lemmas.update(self._lemmas)
+        while len(lemmas) > self.max_size:
+            lemmas.popitem(last=False)
+        self._lemmas = lemmas
+
+    def save(self, path=None):
+        """
+        Saves the cache to `path` (by default, the cache's `path`).
+        Lemmas already saved there are merged in, so that several
+        processes can warm up the same cache file.
+        """
+        path = path or self.path
+        if path is None:
+            raise Exception('No path to save the lemma cache to.')
+        if os.path.exists(path):
+            self.load(path)
+
+        # Write to a temporary file first, so the cache is never half-written
+        tmp = '{}.{}.{}.tmp'.format(path, os.getpid(), threading.get_ident())
+        with open(tmp, 'wb') as f:
+            pickle.dump(list(self._lemmas.items()), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+# Whether shared caches track new lemmas,
+# which worker processes do (see `broca.common.pool`)
+_track_new = False
+
+
+def track_new(enabled=True):
+    """
+    Sets whether the shared caches in this process track new lemmas.
+    """
+    global _track_new
+    with _caches_lock:
+        _track_new = enabled
+        for cache in _caches.values():
+            cache.track_new = enabled
+
+
+def shared_cache(path=None, max_size=100000):
+    """
+    The lemma cache shared by everything in this process
+    which uses `path` (or the in-memory one, if `path` is None).
+    """
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = LemmaCache(max_size=max_size, path=path, track_new=_track_new)
+        return _caches[path]
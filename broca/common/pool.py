@@ -0,0 +1,172 @@
+"""
+A persistent pool of worker processes, shared by the pipes which
+are parallelized with `n_jobs` (through `broca.common.util.parallel`).
+
+Starting processes and loading spaCy, WordNet or the RAKE stop word regex
+are slow, so rather than paying for them on every call,
+workers stay up between calls and each warms up what it needs only once.
+Work is sent to the workers in chunks, so that the function
+(and whatever it's bound to) is pickled once per chunk rather than once per doc.
+"""
+
+import os
+import atexit
+import threading
+from itertools import repeat
+
+
+def resolve_n_jobs(n_jobs):
+    """
+    Number of cores a pipe's `n_jobs` setting occupies,
+    following joblib's convention for negative values.
+    """
+    n_cpus = os.cpu_count() or 1
+    if n_jobs is None or n_jobs == 0:
+        return 1
+    if n_jobs < 0:
+        return max(n_cpus + 1 + n_jobs, 1)
+    return n_jobs
+
+
+def _warm_spacy():
+    from broca.common.shared import spacy
+    spacy.load()
+
+
+def _warm_wordnet():
+    from broca.common.lemma import shared_cache
+
+    # WordNet itself is only loaded on first use
+    shared_cache().lemmatizer.lemmatize('warming', 'v')
+
+
+def _warm_rake():
+    from broca.tokenize.keyword.rake import Rake, stops_path
+    Rake.shared(stops_path)
+
+
+# What workers can be asked to warm up
+warmups = {
+    'spacy': _warm_spacy,
+    'wordnet': _warm_wordnet,
+    'rake': _warm_rake
+}
+
+# What this process has warmed up
+_warmed = set()
+
+
+def warm(names):
+    """
+    Warms up these resources in this process, unless they already are.
+    """
+    for name in names:
+        if name not in _warmed:
+            if name not in warmups:
+                raise Exception('Unknown warmup <{}>, expected one of {}.'.format(name, tuple(warmups)))
+            warmups[name]()
+            _warmed.add(name)
+
+
+def _init_worker(warmup):
+    from broca.common import lemma
+
+    # So lemmas cached in workers can be sent back (see `LemmaTokenizer`)
+    lemma.track_new()
+    warm(warmup)
+
+
+def _run_chunk(func, chunk, expand_args, warmup):
+    warm(warmup)
+    if expand_args:
+        return [func(*args) for args in chunk]
+    else:
+        return [func(arg) for arg in chunk]
+
+
+class WorkerPool():
+    """
+    A pool of `n_jobs` worker processes which stays up between calls to `map`.
+    Each worker warms up `warmup` (names from `warmups`) when it starts.
+    """
+    def __init__(self, n_jobs=-1, warmup=()):
+        self.n_workers = resolve_n_jobs(n_jobs)
+        self.warmup = tuple(warmup)
+        self._executor = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            # A pool inherited by a forked process isn't usable there
+            if self._executor is None or self._pid != os.getpid():
+                from concurrent.futures import ProcessPoolExecutor
+                self._executor = ProcessPoolExecutor(max_workers=self.n_workers,
+                                                     initializer=_init_worker,
+                                                     initargs=(self.warmup,))
+                self._pid = os.getpid()
+            return self._executor
+
+    def map(self, func, inputs, expand_args=False, warmup=(), chunk_size=None):
+        """
+        Applies `func` to each input in the workers, returning the results in order.
+        `warmup` lists what `func` needs warmed up, which each worker does once.
+        Inputs are sent in chunks of `chunk_size`, by default
+        so that each worker gets about four chunks.
+        """
+        inputs = list(inputs)
+        if not inputs:
+            return []
+        if self.n_workers == 1:
+            return _run_chunk(func, inputs, expand_args, warmup)
+
+        if chunk_size is None:
+            chunk_size = max(len(inputs)//(self.n_workers * 4), 1)
+        chunks = [inputs[i:i+chunk_size] for i in range(0, len(inputs), chunk_size)]
+
+        from concurrent.futures.process import BrokenProcessPool
+        executor = self.executor
+        results = []
+        try:
+            for res in executor.map(_run_chunk, repeat(func), chunks, repeat(expand_args), repeat(tuple(warmup))):
+                results.extend(res)
+
+        # A worker died (e.g. it was killed or crashed), which leaves the pool unusable,
+        # so drop it to start a new one on the next call
+        except BrokenProcessPool:
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None and self._pid == os.getpid():
+                self._executor.shutdown()
+            self._executor = None
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def shared_pool(n_jobs=-1):
+    """
+    The worker pool of this size shared by everything in this process.
+    """
+    n_workers = resolve_n_jobs(n_jobs)
+    with _pools_lock:
+        if n_workers not in _pools:
+            _pools[n_workers] = WorkerPool(n_workers)
+        return _pools[n_workers]
+
+
+@atexit.register
+def shutdown_pools():
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.shutdown()
+        _pools.clear()
@@ -1,3 +1,30 @@
 # Load once and share this to reduce memory usage
-from spacy.en import English
-spacy = English()
+import threading
+
+
+class _SharedSpacy():
+    """
+    The shared spaCy model, loaded on first use
+    since it's slow to load and takes up a lot of memory.
+    Call it like the model itself, e.g. `spacy(doc, tag=True)`.
+    """
+    def __init__(self):
+        self._nlp = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        if self._nlp is None:
+            with self._lock:
+                if self._nlp is None:
+                    from spacy.en import English
+                    self._nlp = English()
+        return self._nlp
+
+    def __call__(self, *args, **kwargs):
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        return getattr(self.load(), name)
+
+
+spacy = _SharedSpacy()
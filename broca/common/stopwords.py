@@ -0,0 +1,55 @@
+"""
+Stopword sets, loaded once per process and shared by the tokenizers.
+
+These are frozensets (or, for stopword files, also tuples in their listed order),
+so membership tests are constant-time and they can't be modified by accident.
+"""
+
+import os
+import threading
+
+smart_stoplist = os.path.join(os.path.dirname(__file__), '../data/SmartStoplist.txt')
+
+_sets = {}
+_lock = threading.Lock()
+
+
+def stopwords(lang='english'):
+    """
+    NLTK's stopwords for a language.
+    """
+    key = ('nltk', lang)
+    with _lock:
+        if key not in _sets:
+            # Imported here since it's slow to import
+            from nltk.corpus import stopwords
+            _sets[key] = frozenset(stopwords.words(lang))
+        return _sets[key]
+
+
+def _load_file(path):
+    key = os.path.realpath(path)
+    with _lock:
+        if ('file', key) not in _sets:
+            with open(path, 'r') as f:
+                words = tuple(word for line in f if not line.strip().startswith('#')
+                              for word in line.split())
+            _sets[('list', key)] = words
+            _sets[('file', key)] = frozenset(words)
+    return key
+
+
+def stopwords_file(path=smart_stoplist):
+    """
+    Stopwords listed in a file, by default the SMART stoplist.
+    Lines starting with `#` are ignored.
+    """
+    return _sets[('file', _load_file(path))]
+
+
+def stopwords_list(path=smart_stoplist):
+    """
+    The same stopwords as `stopwords_file`, as a tuple in the order they're listed
+    (e.g. for building a regex, where order matters).
+    """
+    return _sets[('list', _load_file(path))]
@@ -1,5 +1,4 @@
 import numpy as np
-from joblib import Parallel, delayed
 
 
 def penn_to_wordnet(tag):
@@ -56,11 +55,10 @@ def dist_to_sim(dist_mat):
     return 1-np.square(dist_mat/np.max(dist_mat))
 
 
-def parallel(func, inputs, n_jobs, expand_args=False):
+def parallel(func, inputs, n_jobs, expand_args=False, warmup=()):
     """
-    Convenience wrapper around joblib's parallelization.
+    Runs `func` over the inputs in the shared worker pool with `n_jobs` workers
+    (see `broca.common.pool`), which warm up `warmup` once each.
     """
-    if expand_args:
-        return Parallel(n_jobs=n_jobs)(delayed(func)(*args) for args in inputs)
-    else:
-        return Parallel(n_jobs=n_jobs)(delayed(func)(arg) for arg in inputs)
+    from broca.common.pool import shared_pool
+    return shared_pool(n_jobs).map(func, inputs, expand_args=expand_args, warmup=warmup)
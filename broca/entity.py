@@ -1,27 +1,32 @@
 from broca import Pipe
-from broca.common.shared import spacy
+from broca.annotate import annotate, annotate_docs
 from broca.common.util import parallel
 
 
 class Entities(Pipe):
     """
     Extracts entities and uses them as tokens.
+    Docs are parsed in batches of `batch_size` with `n_threads` threads.
     """
     input = Pipe.type.docs
     output = Pipe.type.entities
+    per_doc = True
 
-    def __init__(self, n_jobs=1):
+    def __init__(self, n_jobs=1, batch_size=1000, n_threads=2):
         self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.n_threads = n_threads
 
     def __call__(self, docs):
+        docs = annotate_docs(docs, batch_size=self.batch_size, n_threads=self.n_threads, entity=True)
         if self.n_jobs == 1:
-            return [self._extract(doc) for doc in docs]
+            return [_extract(doc) for doc in docs]
         else:
-            return parallel(self._extract, docs, self.n_jobs)
+            return parallel(_extract, docs, self.n_jobs)
 
-    def _extract(self, doc):
-        res = spacy(doc, entity=True, tag=True, parse=False)
-        return [Entity(e.string, e.label_) for e in res.ents]
+
+def _extract(doc):
+    return [Entity(name, label) for name, label in annotate(doc, entity=True).ents]
 
 
 class Entity():
@@ -0,0 +1,183 @@
+"""
+Pre-tokenized corpora, so that models trained on large text files
+(e.g. `train_phrases`, `train_doc2vec`) can stream tokens from disk
+rather than tokenizing the files on every pass.
+
+`ingest` splits the files into parts by byte range (so they don't need
+to be read beforehand to count lines) and tokenizes the parts in parallel.
+Each part is saved as int32 token ids into its own vocabulary
+(utf8-encoded and concatenated, with the offset of each token), along with
+the offsets of each sequence (sentence or line) and the line it came from.
+Parts are saved as they're finished, so an interrupted ingest resumes
+where it left off.
+"""
+
+import os
+import json
+import shutil
+import numpy as np
+from functools import partial
+from nltk.tokenize import sent_tokenize, word_tokenize
+from broca.common.pool import resolve_n_jobs
+from broca.common.util import parallel
+from broca.pipeline.stream import chunk
+
+VERSION = 1
+
+
+def ingest(paths, dir, tokenizer=word_tokenize, sentences=True, lowercase=True,
+           part_size=2**24, n_jobs=-1, refresh=False):
+    """
+    Tokenizes the files at `paths` into a corpus at `dir`,
+    with each line lowercased (if `lowercase`) and split into sentences
+    (if `sentences`), which are tokenized with `tokenizer`.
+    Files are split into parts of about `part_size` bytes,
+    which are tokenized with `n_jobs`.
+
+    If `dir` already holds the corpus (or part of it), only what's left is tokenized.
+    Set `refresh` to start over.
+    """
+    if refresh and os.path.exists(dir):
+        shutil.rmtree(dir)
+    if not os.path.exists(dir):
+        os.makedirs(dir)
+
+    parts = []
+    for path in paths:
+        size = os.path.getsize(path)
+        for start in range(0, max(size, 1), part_size):
+            parts.append((os.path.abspath(path), start, min(start + part_size, size)))
+
+    manifest = {
+        'version': VERSION,
+        'settings': {
+            'tokenizer': '{}.{}'.format(getattr(tokenizer, '__module__', None) or '',
+                                        getattr(tokenizer, '__qualname__', type(tokenizer).__name__)),
+            'sentences': sentences,
+            'lowercase': lowercase
+        },
+        'parts': parts
+    }
+    manifest_path = os.path.join(dir, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, 'r') as f:
+            existing = json.load(f)
+        if existing != json.loads(json.dumps(manifest)):
+            raise Exception('<{}> holds a corpus ingested from other files or with other settings. Use another directory, or set `refresh=True`.'.format(dir))
+    else:
+        tmp = '{}.{}.tmp'.format(manifest_path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(manifest, f)
+        os.replace(tmp, manifest_path)
+
+    todo = [(i, part) for i, part in enumerate(parts) if not os.path.exists(_part_path(dir, i))]
+    print('Tokenizing {} of {} parts...'.format(len(todo), len(parts)))
+
+    func = partial(_ingest_part, dir=dir, tokenizer=tokenizer, sentences=sentences, lowercase=lowercase)
+    done = len(parts) - len(todo)
+    for batch in chunk(todo, resolve_n_jobs(n_jobs)):
+        parallel(func, batch, n_jobs, expand_args=True)
+        done += len(batch)
+        print('Tokenized {}/{} parts'.format(done, len(parts)))
+
+    return Corpus(dir)
+
+
+def _part_path(dir, i):
+    return os.path.join(dir, 'part.{:05d}.npz'.format(i))
+
+
+def _ingest_part(i, part, dir, tokenizer, sentences, lowercase):
+    path, start, end = part
+    vocab = {}
+    ids, offsets, lines = [], [0], []
+    n_lines = 0
+
+    with open(path, 'rb') as f:
+        # A part has the lines which start within its range
+        if start > 0:
+            f.seek(start - 1)
+            f.readline()
+
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            line = line.decode('utf8')
+            if lowercase:
+                line = line.lower()
+
+            for seq in sent_tokenize(line) if sentences else [line]:
+                for token in tokenizer(seq):
+                    ids.append(vocab.setdefault(token, len(vocab)))
+                offsets.append(len(ids))
+                lines.append(n_lines)
+            n_lines += 1
+
+    # Rather than a fixed-width string array, which pads every token
+    # to the length of the longest one
+    encoded = [token.encode('utf8') for token in vocab]
+    vocab_offsets = np.zeros(len(encoded) + 1, dtype=np.uint64)
+    np.cumsum([len(t) for t in encoded], out=vocab_offsets[1:])
+
+    # Write to a temporary file first, so a part is never half-written
+    tmp = os.path.join(dir, 'part.{:05d}.{}.tmp.npz'.format(i, os.getpid()))
+    np.savez(tmp,
+             ids=np.array(ids, dtype=np.int32),
+             offsets=np.array(offsets, dtype=np.int64),
+             lines=np.array(lines, dtype=np.int32),
+             vocab=np.frombuffer(b''.join(encoded), dtype=np.uint8),
+             vocab_offsets=vocab_offsets,
+             n_lines=n_lines)
+    os.replace(tmp, _part_path(dir, i))
+
+
+def _vocab(part):
+    data = part['vocab'].tobytes()
+    offsets = part['vocab_offsets'].tolist()
+    return [data[offsets[j]:offsets[j+1]].decode('utf8') for j in range(len(offsets) - 1)]
+
+
+class Corpus():
+    """
+    A pre-tokenized corpus (see `ingest`), which can be iterated over
+    any number of times, yielding the tokens of each sequence.
+    """
+    def __init__(self, dir):
+        self.dir = dir
+        with open(os.path.join(dir, 'manifest.json'), 'r') as f:
+            self.manifest = json.load(f)
+
+        n_parts = len(self.manifest['parts'])
+        missing = [i for i in range(n_parts) if not os.path.exists(_part_path(dir, i))]
+        if missing:
+            raise Exception('The corpus at <{}> is missing {} of {} parts. Run `ingest` again to finish it.'.format(dir, len(missing), n_parts))
+
+    def _parts(self):
+        for i in range(len(self.manifest['parts'])):
+            with np.load(_part_path(self.dir, i)) as part:
+                yield part['ids'], part['offsets'], part['lines'], _vocab(part), int(part['n_lines'])
+
+    def __iter__(self):
+        for _, tokens in self.labeled():
+            yield tokens
+
+    def labeled(self):
+        """
+        Yields `(line number, tokens)` for each sequence,
+        with lines numbered across files, from 1.
+        """
+        n_lines = 0
+        for ids, offsets, lines, vocab, part_lines in self._parts():
+            tokens = [vocab[id] for id in ids.tolist()]
+            offsets = offsets.tolist()
+            for j, line in enumerate(lines.tolist()):
+                yield n_lines + line + 1, tokens[offsets[j]:offsets[j+1]]
+            n_lines += part_lines
+
+    def __len__(self):
+        n = 0
+        for i in range(len(self.manifest['parts'])):
+            with np.load(_part_path(self.dir, i)) as part:
+                n += len(part['lines'])
+        return n
@@ -0,0 +1,237 @@
+"""
+Streaming, bounded-memory counting over large corpora.
+
+Docs are counted a chunk at a time in worker processes, each chunk into one `Counter`.
+These shards are merged pairwise as they come in (a tree reduction,
+so no shard is merged into over and over), and once they hold more than
+`max_terms` terms altogether, they're spilled to disk as sorted runs,
+which are merged in a single streaming pass at the end into one run,
+which stays on disk.
+
+The result is a `Counts`, which can be saved, loaded and merged with
+counts for other corpora, so new docs can be counted in later
+without counting everything again.
+"""
+
+import os
+import heapq
+import pickle
+import tempfile
+from functools import partial
+from itertools import groupby
+from collections import Counter
+from broca.common.pool import resolve_n_jobs
+from broca.common.util import parallel
+from broca.pipeline.stream import chunk
+
+
+class Counts():
+    """
+    Term counts along with the number of docs (or whatever items)
+    they were counted over.
+
+    Counts which were spilled to disk stay there as a sorted run
+    until `counts` is accessed, so `items` can stream them instead.
+    """
+    def __init__(self, counts=None, n_docs=0):
+        if isinstance(counts, _Run):
+            self._run, self._counts = counts, None
+        else:
+            self._run, self._counts = None, Counter(counts) if counts is not None else Counter()
+        self.n_docs = n_docs
+
+    @property
+    def counts(self):
+        if self._counts is None:
+            self._counts = Counter()
+            for term, c in self._run:
+                self._counts[term] = c
+            self._run.close()
+            self._run = None
+        return self._counts
+
+    def items(self):
+        """
+        Iterates over the `(term, count)` pairs, without loading spilled counts.
+        """
+        if self._run is not None:
+            return iter(self._run)
+        return iter(self._counts.items())
+
+    def update(self, other):
+        """
+        Adds in the counts of another `Counts` (or the path it was saved to).
+        """
+        if not isinstance(other, Counts):
+            other = Counts.load(other)
+        self.counts.update(other.counts)
+        self.n_docs += other.n_docs
+        return self
+
+    def __add__(self, other):
+        return Counts(self.counts, self.n_docs).update(other)
+
+    def __len__(self):
+        if self._run is not None:
+            return len(self._run)
+        return len(self._counts)
+
+    def save(self, path):
+        # Write to a temporary file first, so the counts are never half-written
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            pickle.dump((self.n_docs, dict(self.items())), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            n_docs, counts = pickle.load(f)
+        return cls(counts, n_docs)
+
+
+def count(items, count_func, chunk_size=1000, n_jobs=-1, max_terms=10000000, spill_dir=None, sketch=None):
+    """
+    Counts over a stream of items (e.g. tokenized docs), where
+    `count_func(item)` returns a mapping of terms to their counts for an item.
+
+    `chunk_size` items are counted together by a worker,
+    and at most `max_terms` terms are held in memory before spilling
+    them to `spill_dir` (by default the system's temporary directory).
+
+    If a `sketch` (see `broca.knowledge.sketch`) is given,
+    the counts are added to it instead, and it's returned.
+    """
+    if sketch is not None:
+        return _count_sketch(items, count_func, sketch, chunk_size, n_jobs)
+
+    n_workers = resolve_n_jobs(n_jobs)
+    spill = _Spill(spill_dir)
+    shards = []
+    n_items = 0
+
+    try:
+        # Only count as many chunks at once as there are workers,
+        # so the stream is never materialized
+        for chunks in chunk(chunk(items, chunk_size), n_workers):
+            n_items += sum(len(c) for c in chunks)
+            for shard in parallel(partial(_count_chunk, count_func=count_func), chunks, n_jobs):
+                _push(shards, shard)
+
+            if sum(len(s) for _, s in shards) > max_terms:
+                spill.write(_collapse(shards))
+                shards = []
+
+        if spill.runs:
+            spill.write(_collapse(shards))
+            shards = []
+            counts = spill.merge()
+        else:
+            counts = _collapse(shards)
+    finally:
+        spill.close()
+
+    return Counts(counts, n_items)
+
+
+def _count_sketch(items, count_func, sketch, chunk_size, n_jobs):
+    n_workers = resolve_n_jobs(n_jobs)
+    for chunks in chunk(chunk(items, chunk_size), n_workers):
+        sketch.n_docs += sum(len(c) for c in chunks)
+        for shard in parallel(partial(_count_chunk, count_func=count_func), chunks, n_jobs):
+            sketch.add(shard)
+    return sketch
+
+
+def _count_chunk(items, count_func):
+    counts = Counter()
+    for item in items:
+        counts.update(count_func(item))
+    return counts
+
+
+def _push(shards, shard):
+    """
+    Adds a shard to a stack of `(level, shard)`, merging it
+    with shards of the same level, like carrying in binary addition.
+    """
+    level = 0
+    while shards and shards[-1][0] == level:
+        _, other = shards.pop()
+        shard = _merge(shard, other)
+        level += 1
+    shards.append((level, shard))
+
+
+def _merge(a, b):
+    # Add the smaller into the larger
+    if len(a) < len(b):
+        a, b = b, a
+    a.update(b)
+    return a
+
+
+def _collapse(shards):
+    counts = Counter()
+    for _, shard in reversed(shards):
+        counts = _merge(counts, shard)
+    return counts
+
+
+class _Spill():
+    """
+    Sorted runs of counts spilled to disk.
+    """
+    def __init__(self, dir=None, batch_size=100000):
+        self.dir = dir
+        self.batch_size = batch_size
+        self.runs = []
+
+    def write(self, counts):
+        self.runs.append(_Run(sorted(counts.items()), self.dir, self.batch_size))
+
+    def merge(self):
+        """
+        Merges the spilled runs, in one pass over each, into a new run.
+        """
+        merged = ((term, sum(c for _, c in group))
+                  for term, group in groupby(heapq.merge(*self.runs), key=lambda item: item[0]))
+        return _Run(merged, self.dir, self.batch_size)
+
+    def close(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+
+
+class _Run():
+    """
+    Sorted `(term, count)` pairs in an anonymous temporary file
+    (so it's removed once closed, even if the process dies),
+    written and read back a batch at a time.
+    """
+    def __init__(self, items, dir=None, batch_size=100000):
+        self.f = tempfile.TemporaryFile(prefix='counts.', dir=dir)
+        self.n = 0
+        for batch in chunk(items, batch_size):
+            pickle.dump(batch, self.f, protocol=pickle.HIGHEST_PROTOCOL)
+            self.n += len(batch)
+
+    def __len__(self):
+        return self.n
+
+    def __iter__(self):
+        # Seek back before each batch, in case the file is read elsewhere in between
+        pos = 0
+        while True:
+            self.f.seek(pos)
+            try:
+                batch = pickle.load(self.f)
+            except EOFError:
+                break
+            pos = self.f.tell()
+            for item in batch:
+                yield item
+
+    def close(self):
+        self.f.close()
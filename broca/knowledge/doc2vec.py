@@ -1,52 +1,48 @@
 from gensim.models.doc2vec import Doc2Vec, LabeledSentence
-from nltk.tokenize import sent_tokenize, word_tokenize
-from sup.progress import Progress
+from nltk.tokenize import word_tokenize
+from broca.knowledge.corpus import ingest
 
 
-def train_doc2vec(paths, out='data/model.d2v', tokenizer=word_tokenize, sentences=False, **kwargs):
+def train_doc2vec(paths, out='data/model.d2v', tokenizer=word_tokenize, sentences=False, corpus_dir=None, n_jobs=-1, **kwargs):
     """
     Train a doc2vec model on a list of files.
+
+    The files are first tokenized (with `n_jobs`) and saved
+    to `corpus_dir` (by default, next to `out`), see `broca.knowledge.corpus`.
+    An interrupted run picks up from there, and the model is trained
+    from the saved tokens.
     """
-    kwargs = {
+    if corpus_dir is None:
+        corpus_dir = '{}.corpus'.format(out)
+
+    params = {
         'size': 400,
         'window': 8,
         'min_count': 2,
         'workers': 8
-    }.update(kwargs)
+    }
+    params.update(kwargs)
 
-    n = 0
-    for path in paths:
-        print('Counting lines for {0}...'.format(path))
-        n += sum(1 for line in open(path, 'r'))
-    print('Processing {0} lines...'.format(n))
+    # We do minimal pre-processing here so the model can learn
+    # punctuation
+    print('Tokenizing...')
+    corpus = ingest(paths, corpus_dir, tokenizer=tokenizer, sentences=sentences, n_jobs=n_jobs)
 
     print('Training doc2vec model...')
-    m = Doc2Vec(_doc2vec_doc_stream(paths, n, tokenizer=tokenizer, sentences=sentences), **kwargs)
+    m = Doc2Vec(_LabeledCorpus(corpus), **params)
 
     print('Saving...')
     m.save(out)
 
 
-def _doc2vec_doc_stream(paths, n, tokenizer=word_tokenize, sentences=True):
+class _LabeledCorpus():
     """
-    Generator to feed sentences to the dov2vec model.
+    Feeds sentences to the doc2vec model, labeled by the line they're from.
+    It can be iterated over more than once, as the model does.
     """
-    i = 0
-    p = Progress()
-    for path in paths:
-        with open(path, 'r') as f:
-            for line in f:
-                i += 1
-                p.print_progress(i/n)
-
-                # We do minimal pre-processing here so the model can learn
-                # punctuation
-                line = line.lower()
-
-                if sentences:
-                    for sent in sent_tokenize(line):
-                        tokens = tokenizer(sent)
-                        yield LabeledSentence(tokens, ['SENT_{}'.format(i)])
-                else:
-                    tokens = tokenizer(line)
-                    yield LabeledSentence(tokens, ['SENT_{}'.format(i)])
+    def __init__(self, corpus):
+        self.corpus = corpus
+
+    def __iter__(self):
+        for i, tokens in self.corpus.labeled():
+            yield LabeledSentence(tokens, ['SENT_{}'.format(i)])
@@ -1,28 +1,59 @@
+import os
+import sys
 import json
 import math
-from collections import defaultdict
-from broca.common.util import parallel
-from broca.knowledge.util import merge
+import mmap
+import struct
+import numpy as np
+from bisect import bisect_left
+from collections import defaultdict, Counter
+from broca.knowledge.counts import count
+from broca.knowledge.util import term_hash
+from broca.knowledge.sketch import CountMinSketch
 
 
-def train_idf(tokens_stream, out=None, **kwargs):
+def train_idf(tokens_stream, out=None, binary=False, counts=None, save_counts=None, sketch=None, **kwargs):
     """
-    Train a IDF model on a list of files (parallelized).
+    Train a IDF model on a stream of tokenized docs (parallelized).
+    If `binary` is True, the model is saved to `out` in the binary format
+    (see `save_idf`), otherwise as JSON.
+
+    Docs are counted in bounded memory (see `broca.knowledge.counts.count`,
+    which takes the remaining keyword arguments). To add to document frequencies
+    counted earlier, pass them (or the path they were saved to) as `counts`;
+    to save them for later, specify `save_counts`.
+
+    If a `sketch` (see `broca.knowledge.sketch`) is given, document frequencies
+    are counted approximately into it, and the sketch is returned (and saved to `out`)
+    instead. `IDF` can load the saved sketch.
     """
-    idfs = parallel(count_idf, tokens_stream, n_jobs=-1)
-    N = len(idfs) # n docs
-    idf = merge(idfs)
+    if sketch is not None and (counts is not None or save_counts is not None):
+        raise Exception('`counts` and `save_counts` are for exact counts. To add to a sketch, pass it (e.g. loaded with `CountMinSketch.load`) as `sketch`, and save it with `out`.')
+    dfs = count(tokens_stream, count_idf, sketch=sketch, **kwargs)
+    if counts is not None:
+        dfs.update(counts)
+    if save_counts is not None:
+        dfs.save(save_counts)
 
-    for k, v in idf.items():
+    if sketch is not None:
+        if out is not None:
+            sketch.save(out)
+        return sketch
+
+    N = dfs.n_docs
+    idf = {}
+    for k, v in dfs.items():
         idf[k] = math.log(N/v)
-        # v ~= N/(math.e ** idf[k])
 
     # Keep track of N to update IDFs
     idf['_n_docs'] = N
 
     if out is not None:
-        with open(out, 'w') as f:
-            json.dump(idf, f)
+        if binary:
+            _save_binary(dfs.items(), N, out)
+        else:
+            with open(out, 'w') as f:
+                json.dump(idf, f)
 
     return idf
 
@@ -35,13 +66,281 @@ def count_idf(tokens):
     return idf
 
 
+# Binary format:
+#   header: magic, version (uint32), n terms (uint64), n docs (uint64)
+#   n terms uint64 term hashes, sorted
+#   n terms uint64 document frequencies, in the same order
+#   n terms + 1 uint64 offsets of the terms in...
+#   ...the utf8-encoded terms, concatenated
+MAGIC = b'BIDF'
+VERSION = 2
+header = struct.Struct('<4sIQQ')
+
+
+def _to_dfs(idf):
+    """
+    Recovers document frequencies from an IDF dict (with `_n_docs`),
+    since v = N/(math.e ** idf[k]).
+    """
+    N = idf['_n_docs']
+    return {k: int(round(N/math.exp(v))) for k, v in idf.items() if k != '_n_docs'}
+
+
+def save_idf(idf, path):
+    """
+    Saves an IDF dict (as returned by `train_idf`, with `_n_docs`)
+    in the binary format, which `IDF` memory-maps rather than loading.
+    """
+    _save_binary(_to_dfs(idf).items(), idf['_n_docs'], path)
+
+
+def _save_binary(items, n_docs, path):
+    """
+    Saves `(term, document frequency)` pairs in the binary format.
+    """
+    terms, dfs = [], []
+    for term, df in items:
+        terms.append(term)
+        dfs.append(df)
+    hashes = np.array([term_hash(t) for t in terms], dtype='<u8')
+    dfs = np.array(dfs, dtype='<u8')
+    order = np.argsort(hashes, kind='stable')
+
+    encoded = [terms[i].encode('utf8') for i in order]
+    offsets = np.zeros(len(encoded) + 1, dtype='<u8')
+    np.cumsum([len(t) for t in encoded], out=offsets[1:])
+
+    # Write to a temporary file first, since the model
+    # may be memory-mapped from `path` (and so mustn't be truncated)
+    tmp = '{}.{}.tmp'.format(path, os.getpid())
+    with open(tmp, 'wb') as f:
+        f.write(header.pack(MAGIC, VERSION, len(terms), n_docs))
+        f.write(hashes[order].tobytes())
+        f.write(dfs[order].tobytes())
+        f.write(offsets.tobytes())
+        f.write(b''.join(encoded))
+    os.replace(tmp, path)
+
+
 class IDF():
-    def __init__(self, path):
-        self._idf = json.load(open(path, 'r'))
+    """
+    An IDF model, either saved as JSON (which is loaded into memory)
+    or in the binary format (see `save_idf`), which is memory-mapped instead,
+    so it loads instantly and processes using the same model share its memory.
+    It can also be a saved `CountMinSketch` of document frequencies,
+    in which case IDFs are approximate (and never too high).
+
+    The model keeps document frequencies rather than IDFs,
+    so that new docs can be counted in with `update`; IDFs are computed as they're looked up.
+    Terms which aren't in the model get the IDF of a term seen in a single doc.
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self._dfs = {}
+        self._n_docs = 0
+        if path is not None:
+            with open(path, 'rb') as f:
+                binary = f.read(len(MAGIC)) == MAGIC
+
+            if binary:
+                self._dfs = _BinaryIDF(path)
+                self._n_docs = self._dfs.n_docs
+            elif CountMinSketch.is_sketch(path):
+                self._dfs = CountMinSketch.load(path)
+                self._n_docs = self._dfs.n_docs
+            else:
+                idf = json.load(open(path, 'r'))
+                self._dfs = _to_dfs(idf)
+                self._n_docs = idf['_n_docs']
+
+        # Counted in by `update`
+        self._new = Counter()
+        self._n_new = 0
+
+    @property
+    def n_docs(self):
+        return self._n_docs + self._n_new
+
+    @property
+    def default(self):
+        return math.log(self.n_docs + 1)
+
+    def df(self, term):
+        """
+        Number of docs a term occurs in.
+        """
+        return self._dfs.get(term, 0) + self._new.get(term, 0)
 
     def __getitem__(self, term):
-        N = self._idf['_n_docs'] + 1
-        return self._idf.get(term, math.log(N/1))
+        df = self._dfs.get(term, 0)
+        if self._new:
+            df += self._new.get(term, 0)
+        if not df:
+            return self.default
+        return math.log((self._n_docs + self._n_new)/df)
 
     def __contains__(self, term):
-        return term in self._idf
+        return self.df(term) > 0
+
+    def lookup(self, terms):
+        """
+        IDFs for a list of terms, as an array.
+        """
+        terms = list(terms)
+        if hasattr(self._dfs, 'lookup'):
+            dfs = self._dfs.lookup(terms).astype(np.float64)
+        else:
+            dfs = np.array([self._dfs.get(t, 0) for t in terms], dtype=np.float64)
+        if self._new:
+            dfs += np.array([self._new.get(t, 0) for t in terms], dtype=np.float64)
+
+        idfs = np.full(len(terms), self.default)
+        seen = dfs > 0
+        idfs[seen] = np.log(self.n_docs/dfs[seen])
+        return idfs.astype(np.float32)
+
+    def update(self, tokens_stream, **kwargs):
+        """
+        Counts new tokenized docs into the model
+        (see `broca.knowledge.counts.count` for the keyword arguments).
+        """
+        counts = count(tokens_stream, count_idf, **kwargs)
+        self._new.update(counts.counts)
+        self._n_new += counts.n_docs
+        return self
+
+    def save(self, path, binary=False):
+        """
+        Saves the model, including any updates, as JSON or in the binary format
+        (or, if it's a sketch, as a sketch).
+        """
+        if isinstance(self._dfs, CountMinSketch):
+            sketch = self._dfs.copy().add(self._new)
+            sketch.n_docs = self.n_docs
+            sketch.save(path)
+            return
+
+        dfs = Counter(dict(self._dfs.items()))
+        dfs.update(self._new)
+        if binary:
+            _save_binary(dfs.items(), self.n_docs, path)
+        else:
+            N = self.n_docs
+            idf = {k: math.log(N/v) for k, v in dfs.items()}
+            idf['_n_docs'] = N
+            with open(path, 'w') as f:
+                json.dump(idf, f)
+
+    def __getstate__(self):
+        # Reopen rather than copy the model,
+        # e.g. when it's sent to worker processes
+        return {'path': self.path, 'new': self._new, 'n_new': self._n_new}
+
+    def __setstate__(self, state):
+        self.__init__(state['path'])
+        self._new = state['new']
+        self._n_new = state['n_new']
+
+
+class _BinaryIDF():
+    """
+    Dict-like access to the document frequencies in a binary IDF file.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, n, n_docs = header.unpack_from(self._mm)
+        if version != VERSION:
+            raise Exception('Unsupported IDF format version <{}>, expected <{}>.'.format(version, VERSION))
+
+        self.n = n
+        self.n_docs = n_docs
+        offset = header.size
+        self._hashes = np.frombuffer(self._mm, dtype='<u8', count=n, offset=offset)
+        offset += 8 * n
+        self._dfs = np.frombuffer(self._mm, dtype='<u8', count=n, offset=offset)
+        offset += 8 * n
+        self._offsets = np.frombuffer(self._mm, dtype='<u8', count=n+1, offset=offset)
+        self._terms = memoryview(self._mm)[offset + 8 * (n+1):]
+
+        # Looking up single terms through numpy is slow,
+        # so use plain memoryviews where the byte order allows
+        if sys.byteorder == 'little':
+            self._hashes = memoryview(self._hashes).cast('B').cast('Q')
+            self._offsets = memoryview(self._offsets).cast('B').cast('Q')
+            self._df_view = memoryview(self._dfs).cast('B').cast('Q')
+        else:
+            self._df_view = self._dfs
+
+    def _find(self, term, h=None, i=None):
+        """
+        Index of a term, or -1 if it's not in the model.
+        """
+        if h is None:
+            h = term_hash(term)
+        if i is None:
+            i = bisect_left(self._hashes, h)
+
+        # Terms whose hashes collide are next to each other
+        term = term.encode('utf8')
+        while i < self.n and self._hashes[i] == h:
+            if self._terms[self._offsets[i]:self._offsets[i+1]] == term:
+                return i
+            i += 1
+        return -1
+
+    def __getitem__(self, key):
+        value = self.get(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        i = self._find(key)
+        if i < 0:
+            return default
+        return int(self._df_view[i])
+
+    def __contains__(self, key):
+        return self._find(key) >= 0
+
+    def __len__(self):
+        return self.n
+
+    def items(self):
+        offsets = np.asarray(self._offsets, dtype='<u8').tolist()
+        for i, df in enumerate(np.asarray(self._dfs).tolist()):
+            yield bytes(self._terms[offsets[i]:offsets[i+1]]).decode('utf8'), df
+
+    def lookup(self, terms):
+        """
+        Document frequencies for a list of terms (0 for those not in the model), as an array.
+        """
+        terms = list(terms)
+        dfs = np.zeros(len(terms), dtype='<u8')
+        if not terms or not self.n:
+            return dfs
+
+        stored = np.asarray(self._hashes, dtype='<u8')
+        hashes = np.array([term_hash(t) for t in terms], dtype='<u8')
+        idx = np.minimum(np.searchsorted(stored, hashes), self.n-1)
+        found = np.flatnonzero(stored[idx] == hashes)
+
+        # Check that it's the term itself and not a colliding one
+        offsets = np.asarray(self._offsets, dtype='<u8')
+        starts = offsets[idx[found]].tolist()
+        ends = offsets[idx[found] + 1].tolist()
+        matched = []
+        for j, start, end in zip(found.tolist(), starts, ends):
+            if self._terms[start:end] == terms[j].encode('utf8'):
+                matched.append((j, idx[j]))
+            else:
+                i = self._find(terms[j], int(hashes[j]), int(idx[j]))
+                if i >= 0:
+                    matched.append((j, i))
+
+        if matched:
+            js, ids = zip(*matched)
+            dfs[list(js)] = np.asarray(self._dfs)[list(ids)]
+        return dfs
@@ -1,42 +1,32 @@
 from gensim.models import Phrases
-from sup.progress import Progress
-from nltk.tokenize import sent_tokenize, word_tokenize
+from nltk.tokenize import word_tokenize
+from broca.knowledge.corpus import ingest
 
 
-def train_phrases(paths, out='data/bigram_model.phrases', tokenizer=word_tokenize, **kwargs):
+def train_phrases(paths, out='data/bigram_model.phrases', tokenizer=word_tokenize, corpus_dir=None, n_jobs=-1, **kwargs):
     """
     Train a bigram phrase model on a list of files.
+
+    The files are first tokenized into sentences (with `n_jobs`) and saved
+    to `corpus_dir` (by default, next to `out`), see `broca.knowledge.corpus`.
+    An interrupted run picks up from there, and the model is trained
+    from the saved tokens.
     """
-    n = 0
-    for path in paths:
-        print('Counting lines for {0}...'.format(path))
-        n += sum(1 for line in open(path, 'r'))
-    print('Processing {0} lines...'.format(n))
+    if corpus_dir is None:
+        corpus_dir = '{}.corpus'.format(out)
 
     # Change to use less memory. Default is 40m.
-    kwargs = {
+    params = {
         'max_vocab_size': 40000000,
         'threshold': 8.
-    }.update(kwargs)
+    }
+    params.update(kwargs)
+
+    print('Tokenizing...')
+    corpus = ingest(paths, corpus_dir, tokenizer=tokenizer, sentences=True, n_jobs=n_jobs)
 
     print('Training bigrams...')
-    bigram = Phrases(_phrase_doc_stream(paths, n, tokenizer=word_tokenize), **kwargs)
+    bigram = Phrases(corpus, **params)
 
     print('Saving...')
     bigram.save(out)
-
-
-def _phrase_doc_stream(paths, n, tokenizer=word_tokenize):
-    """
-    Generator to feed sentences to the phrase model.
-    """
-    i = 0
-    p = Progress()
-    for path in paths:
-        with open(path, 'r') as f:
-            for line in f:
-                i += 1
-                p.print_progress(i/n)
-                for sent in sent_tokenize(line.lower()):
-                    tokens = tokenizer(sent)
-                    yield tokens
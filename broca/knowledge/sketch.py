@@ -0,0 +1,173 @@
+"""
+Approximate counting in fixed memory, for vocabularies
+(e.g. keyphrases over a web crawl) too large to count exactly.
+
+A `CountMinSketch` can stand in for exact counts: pass it as `sketch`
+to `train_tf`, `train_idf` or `broca.knowledge.counts.count`,
+and load a saved one with `IDF` to look up IDFs from it.
+"""
+
+import os
+import math
+import heapq
+import pickle
+import numpy as np
+from operator import itemgetter
+from broca.knowledge.util import term_hash
+
+MAGIC = b'BCMS'
+VERSION = 1
+
+
+def _mix(x):
+    """
+    The splitmix64 finalizer, to derive well-spread hashes from `term_hash`.
+    """
+    x = (x ^ (x >> np.uint64(30))) * np.uint64(0xbf58476d1ce4e5b9)
+    x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94d049bb133111eb)
+    return x ^ (x >> np.uint64(31))
+
+
+class CountMinSketch():
+    """
+    A count-min sketch, which estimates counts in `depth` x `width` counters
+    (8 bytes each), along with the `k` terms with the highest estimated counts
+    (the heavy hitters), since the sketch itself can't list terms.
+
+    Estimates are never too low, and with probability `1 - delta` they are too high
+    by at most `epsilon` times the total of all counts. These set the width
+    (`e/epsilon`) and depth (`ln(1/delta)`), unless they're given directly.
+    """
+    def __init__(self, epsilon=1e-5, delta=1e-3, k=1000, width=None, depth=None):
+        self.width = width or int(math.ceil(math.e/epsilon))
+        self.depth = depth or int(math.ceil(math.log(1/delta)))
+        self.k = k
+        self.table = np.zeros((self.depth, self.width), dtype=np.uint64)
+        self.top = {}
+        self.total = 0
+        self.n_docs = 0
+
+    @property
+    def nbytes(self):
+        return self.table.nbytes
+
+    def _indices(self, terms):
+        # Double hashing: row i uses h1 + i * h2
+        hashes = np.array([term_hash(t) for t in terms], dtype=np.uint64)
+        h1 = _mix(hashes)
+        h2 = _mix(hashes ^ np.uint64(0x9e3779b97f4a7c15)) | np.uint64(1)
+        rows = np.arange(self.depth, dtype=np.uint64)[:, None]
+        return ((h1[None, :] + rows * h2[None, :]) % np.uint64(self.width)).astype(np.intp)
+
+    def _estimate(self, idx):
+        return self.table[np.arange(self.depth)[:, None], idx].min(axis=0)
+
+    def add(self, counts):
+        """
+        Adds in a mapping of terms to counts.
+        """
+        if not counts:
+            return self
+        terms = list(counts)
+        values = np.fromiter(counts.values(), dtype=np.uint64, count=len(terms))
+        idx = self._indices(terms)
+        for row in range(self.depth):
+            np.add.at(self.table[row], idx[row], values)
+        self.total += int(values.sum())
+        self._update_top(terms, self._estimate(idx))
+        return self
+
+    def _update_top(self, terms, estimates):
+        # Only terms which beat the lowest heavy hitter can become one.
+        # (The estimates of heavy hitters not among these terms are kept,
+        # though collisions may have raised them a little since.)
+        if len(self.top) >= self.k:
+            keep = np.flatnonzero(estimates > min(self.top.values()))
+            terms = [terms[i] for i in keep.tolist()]
+            estimates = estimates[keep]
+
+        candidates = self.top
+        candidates.update(zip(terms, estimates.tolist()))
+        if len(candidates) > self.k:
+            candidates = dict(heapq.nlargest(self.k, candidates.items(), key=itemgetter(1)))
+        self.top = candidates
+
+    def update(self, other):
+        """
+        Merges in another sketch (or the path it was saved to)
+        of the same dimensions.
+        """
+        if not isinstance(other, CountMinSketch):
+            other = CountMinSketch.load(other)
+        if other.table.shape != self.table.shape:
+            raise Exception('Can\'t merge sketches of different dimensions ({} and {}).'.format(self.table.shape, other.table.shape))
+        self.table += other.table
+        self.total += other.total
+        self.n_docs += other.n_docs
+        terms = list(set(self.top) | set(other.top))
+        self.top = {}
+        if terms:
+            self._update_top(terms, self.lookup(terms))
+        return self
+
+    def lookup(self, terms):
+        """
+        Estimated counts for a list of terms, as an array.
+        """
+        terms = list(terms)
+        if not terms:
+            return np.zeros(0, dtype=np.uint64)
+        return self._estimate(self._indices(terms))
+
+    def __getitem__(self, term):
+        return int(self.lookup([term])[0])
+
+    def get(self, term, default=None):
+        estimate = self[term]
+        return estimate if estimate else default
+
+    def __contains__(self, term):
+        return self[term] > 0
+
+    def most_common(self, n=None):
+        """
+        The heavy hitters and their estimated counts, highest first.
+        """
+        items = sorted(self.top.items(), key=itemgetter(1), reverse=True)
+        return items if n is None else items[:n]
+
+    def copy(self):
+        sketch = CountMinSketch(k=self.k, width=self.width, depth=self.depth)
+        sketch.table[:] = self.table
+        sketch.top = dict(self.top)
+        sketch.total = self.total
+        sketch.n_docs = self.n_docs
+        return sketch
+
+    def save(self, path):
+        # Write to a temporary file first, so the sketch
+        # is never seen half-written (e.g. by `IDF`)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            pickle.dump((VERSION, self.k, self.total, self.n_docs, self.top, self.table), f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise Exception('<{}> is not a saved sketch.'.format(path))
+            version, k, total, n_docs, top, table = pickle.load(f)
+        sketch = cls(k=k, depth=table.shape[0], width=table.shape[1])
+        sketch.table = table
+        sketch.total = total
+        sketch.n_docs = n_docs
+        sketch.top = top
+        return sketch
+
+    @staticmethod
+    def is_sketch(path):
+        with open(path, 'rb') as f:
+            return f.read(len(MAGIC)) == MAGIC
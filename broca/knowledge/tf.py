@@ -1,18 +1,36 @@
 import json
 from collections import defaultdict
-from broca.common.util import parallel
-from broca.knowledge.util import merge
+from broca.knowledge.counts import count
 
 
-def train_tf(tokens_stream, out=None, **kwargs):
+def train_tf(tokens_stream, out=None, counts=None, save_counts=None, sketch=None, **kwargs):
     """
     Train a map of term frequencies on a list of files (parallelized).
+    Each item of `tokens_stream` is a stream of tokenized docs (e.g. for a file).
+
+    Files are counted in bounded memory (see `broca.knowledge.counts.count`,
+    which takes the remaining keyword arguments). To add to term frequencies
+    counted earlier, pass them (or the path they were saved to) as `counts`;
+    to save them for later, specify `save_counts`.
+
+    If a `sketch` (see `broca.knowledge.sketch`) is given, terms are counted
+    approximately into it, and the sketch is returned (and saved to `out`) instead.
     """
     print('Counting terms...')
-    results = parallel(count_tf, tokens_stream, n_jobs=-1)
+    if sketch is not None and (counts is not None or save_counts is not None):
+        raise Exception('`counts` and `save_counts` are for exact counts. To add to a sketch, pass it (e.g. loaded with `CountMinSketch.load`) as `sketch`, and save it with `out`.')
+    tfs = count(tokens_stream, count_tf, sketch=sketch, **kwargs)
+    if counts is not None:
+        tfs.update(counts)
+    if save_counts is not None:
+        tfs.save(save_counts)
+
+    if sketch is not None:
+        if out is not None:
+            sketch.save(out)
+        return sketch
 
-    print('Merging...')
-    tf = merge(results)
+    tf = dict(tfs.items())
 
     if out is not None:
         with open(out, 'w') as f:
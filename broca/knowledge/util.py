@@ -1,5 +1,5 @@
 import os
-import numpy as np
+import zlib
 from itertools import chain, islice
 from collections import defaultdict
 from broca.common.util import parallel
@@ -10,11 +10,22 @@ def merge(dicts):
     Merges a list of dicts, summing their values.
     (Parallelized wrapper around `_count`)
     """
-    chunks = [args for args in np.array_split(dicts, 20)]
+    dicts = list(dicts)
+    size = max(len(dicts)//20, 1)
+    chunks = [dicts[i:i+size] for i in range(0, len(dicts), size)]
     results = parallel(_count, chunks, n_jobs=-1)
     return _count(results)
 
 
+def term_hash(term):
+    """
+    A stable 64bit hash of a term (Python's `hash` differs across processes).
+    It only needs to be fast and spread terms out; it's not collision-resistant.
+    """
+    term = term.encode('utf8')
+    return (zlib.adler32(term) << 32) | zlib.crc32(term)
+
+
 def _count(dicts):
     """
     Merge a list of dicts, summing their values.
@@ -1,6 +1,5 @@
 import re
 from warnings import warn
-from eatiht import v2 as eatiht
 from urllib.error import HTTPError
 
 wiki_footnote_re = re.compile(r'\[\s*[A-Za-z0-9\s]+\s*\]')
@@ -20,6 +19,9 @@ class Wikipedia():
         # TO DO use wiki_conn if available
         url = wikipedia + term.replace(' ', '_')
 
+        # Imported here since it's slow to import
+        from eatiht import v2 as eatiht
+
         try:
             text = eatiht.extract(url)
 
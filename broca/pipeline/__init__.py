@@ -1,5 +1,10 @@
+import copy
 from itertools import product
+from collections import OrderedDict
 from broca.pipeline.cryo import Cryo
+from broca.pipeline.executor import run_tasks, n_workers
+from broca.pipeline import stream as streaming
+from broca.pipeline.profile import Profiler
 from broca.pipeline.pipe import PipeType
 
 
@@ -7,7 +12,23 @@ class Pipeline():
     def __init__(self, *pipes, **kwargs):
         self.freeze = kwargs.get('freeze', True)
         self.refresh = kwargs.get('refresh', False)
-        self.cryo = Cryo(refresh=self.refresh)
+        self.share_prefixes = kwargs.get('share_prefixes', True)
+
+        # How independent branches and pipelines are run:
+        # 'serial', 'thread' or 'process'
+        self.executor = kwargs.get('executor', 'serial')
+        self.max_workers = kwargs.get('max_workers')
+
+        # Number of documents per chunk when streaming
+        self.chunk_size = kwargs.get('chunk_size', 1000)
+
+        # Records timings, cache hits, etc for each pipe run,
+        # if `profile=True` or a `Profiler` is passed
+        self.profiler = kwargs.get('profiler')
+        if self.profiler is None and kwargs.get('profile', False):
+            self.profiler = Profiler()
+
+        self.cryo = Cryo(refresh=self.refresh, storage=kwargs.get('storage'))
 
         # If any of the pipes is a list or a multi-pipeline, we are building multiple pipelines
         if any(isinstance(p, list) or self._is_multi(p) for p in pipes):
@@ -21,8 +42,12 @@ class Pipeline():
                 else:
                     c_pipes.append([p])
 
-            # Build each pipeline
-            self.pipelines = [Pipeline(*pipes_) for pipes_ in product(*c_pipes)]
+            # Build each pipeline,
+            # sharing storage so they can reuse each other's frozen results
+            kwargs['storage'] = self.cryo.storage
+            kwargs['profiler'] = self.profiler
+            self.pipelines = [Pipeline(*pipes_, **kwargs) for pipes_ in product(*c_pipes)]
+            self.trie = self._compile()
 
         else:
             self.pipes = pipes
@@ -62,30 +87,200 @@ class Pipeline():
     def _is_multi(self, pipe):
         return isinstance(pipe, Pipeline) and hasattr(pipe, 'pipelines')
 
+    def _steps(self):
+        """
+        The pipeline's steps, with nested pipelines flattened out.
+        """
+        steps = []
+        for pipe in self.pipes:
+            if isinstance(pipe, Pipeline):
+                steps += pipe._steps()
+            else:
+                steps.append(pipe)
+        return steps
+
+    def _compile(self):
+        """
+        Compiles a multi-pipeline's pipelines into a prefix tree of their steps,
+        so that steps shared by several pipelines (e.g. the same cleaners
+        preceding different vectorizers) are only run once.
+
+        Steps are considered shared only if they are the same pipe objects.
+        """
+        root = {'children': OrderedDict()}
+        for i, pipeline in enumerate(self.pipelines):
+            node = root
+            for step in pipeline._steps():
+                key = tuple(id(p) for p in step) if isinstance(step, tuple) else id(step)
+                if key not in node['children']:
+                    node['children'][key] = {'step': step, 'children': OrderedDict(), 'leaves': []}
+                node = node['children'][key]
+            node['leaves'].append(i)
+        return root
+
     def __call__(self, input):
         if hasattr(self, 'pipelines'):
-            return tuple(p(input) for p in self.pipelines)
+            if self.share_prefixes:
+                outputs = self._run_trie(self.trie, input, None)
+                return tuple(outputs[i] for i in range(len(self.pipelines)))
+            return tuple(self._run_tasks(
+                [(p, (input,)) for p in self.pipelines],
+                [pipe for p in self.pipelines for pipe in p._pipes()]))
         else:
+            digest = None
             for pipe in self.pipes:
-                # Branch
-                if isinstance(pipe, tuple):
-                    # Multi-to-branch/branch-to-branch
-                    if isinstance(input, tuple):
-                        output = tuple(self.cryo(p, i) if self.freeze else p(i) for p, i in zip(pipe, input))
-
-                    # One-to-branch
-                    else:
-                        output = tuple(self.cryo(p, input) if self.freeze else p(input) for p in pipe)
-                else:
-                    if isinstance(input, tuple):
-                        output = self.cryo(pipe, *input) if self.freeze else pipe(*input)
-                    else:
-                        output = self.cryo(pipe, input) if self.freeze else pipe(input)
-                input = output
-            return output
+                input, digest = self._step(pipe, input, digest)
+            return input
+
+    def stream(self, docs, chunk_size=None):
+        """
+        Runs the pipeline over an iterable of documents in chunks,
+        so the full corpus is never held in memory at once
+        (as long as its pipes process documents independently).
+
+        Chunks are pushed lazily through consecutive per-document pipes;
+        the stream is only materialized at pipes which need the whole corpus.
+
+        If the pipeline ends with per-document pipes, this returns
+        an iterator over the output for each document (tuples of outputs
+        if the pipeline ends with a branching segment).
+        Otherwise it returns the output of the last pipe.
+        """
+        if hasattr(self, 'pipelines'):
+            raise Exception('Streaming is not supported for multi-pipelines.')
+
+        chunk_size = chunk_size or self.chunk_size
+        chunks = streaming.chunk(docs, chunk_size)
+        steps = self._steps()
+        for i, step in enumerate(steps):
+            if self._per_doc(step):
+                chunks = self._stream_step(step, chunks)
+            else:
+                output, _ = self._step(step, streaming.concat(chunks))
+                if i == len(steps) - 1:
+                    return output
+                chunks = streaming.rechunk(output, chunk_size)
+        return streaming.unchunk(chunks)
+
+    def _stream_step(self, step, chunks):
+        for chunk in chunks:
+            output, _ = self._step(step, chunk)
+            yield output
+
+    def _per_doc(self, step):
+        if isinstance(step, tuple):
+            return all(getattr(p, 'per_doc', False) for p in step)
+        return getattr(step, 'per_doc', False)
+
+    def _pipes(self):
+        """
+        All the individual pipes in this pipeline, including branches.
+        """
+        if hasattr(self, 'pipelines'):
+            return [pipe for p in self.pipelines for pipe in p._pipes()]
+        pipes = []
+        for step in self._steps():
+            pipes += list(step) if isinstance(step, tuple) else [step]
+        return pipes
+
+    def _run_tasks(self, tasks, pipes):
+        """
+        Runs independent `(func, args)` tasks with the pipeline's executor,
+        within its worker budget. Results are returned in order.
+        """
+        return run_tasks(tasks, self.executor, n_workers(pipes, self.max_workers))
+
+    def _run_trie(self, node, input, digest, copy_input=False):
+        """
+        Runs the prefix tree depth-first, fanning out each step's output
+        in memory to the steps which follow it. Sibling subtrees are independent,
+        so they are run with the pipeline's executor.
+
+        If `copy_input`, each subtree but the last gets its own copy of the input,
+        so pipes which modify their input in place don't affect the others.
+
+        Returns a map of pipeline indices to their outputs.
+        """
+        children = list(node['children'].values())
+        inputs = _fan_out(input, len(children)) if copy_input else [input for _ in children]
+        results = self._run_tasks(
+            [(self._run_subtrie, (child, i, digest)) for child, i in zip(children, inputs)],
+            [pipe for child in children for pipe in self._trie_pipes(child)])
+
+        outputs = {}
+        for result in results:
+            outputs.update(result)
+        return outputs
+
+    def _run_subtrie(self, node, input, digest):
+        output, out_digest = self._step(node['step'], input, digest)
+
+        # Pipelines ending here get copies if other steps follow,
+        # which may modify the output in place
+        leaves = node['leaves']
+        if node['children']:
+            outputs = {i: copy.deepcopy(output) for i in leaves}
+            outputs.update(self._run_trie(node, output, out_digest, copy_input=True))
+        else:
+            outputs = dict(zip(leaves, _fan_out(output, len(leaves))))
+        return outputs
+
+    def _trie_pipes(self, node):
+        step = node['step']
+        pipes = list(step) if isinstance(step, tuple) else [step]
+        for child in node['children'].values():
+            pipes += self._trie_pipes(child)
+        return pipes
+
+    def _step(self, pipe, input, digest=None):
+        """
+        Runs a single pipe or branching segment.
+        Returns the output along with its content digest, which
+        is carried along so each step's output is only hashed once
+        (the digest is `None` if the pipeline isn't frozen).
+        """
+        # Branch
+        if isinstance(pipe, tuple):
+            # Multi-to-branch/branch-to-branch
+            if isinstance(input, tuple):
+                digests = digest if digest is not None else tuple(None for i in input)
+                tasks = [(self._run_pipe, (p, (i,), (d,))) for p, i, d in zip(pipe, input, digests)]
+
+            # One-to-branch
+            else:
+                tasks = [(self._run_pipe, (p, (input,), (digest,))) for p in pipe]
+
+            results = self._run_tasks(tasks, pipe)
+            return tuple(r for r, d in results), tuple(d for r, d in results)
+        else:
+            if isinstance(input, tuple):
+                return self._run_pipe(pipe, input, digest)
+            else:
+                return self._run_pipe(pipe, (input,), (digest,))
+
+    def _run_pipe(self, pipe, args, digests=None):
+        if self.profiler is not None:
+            start = self.profiler.start()
+        stats = {}
+        if not self.freeze:
+            output, digest = pipe(*args), None
+        else:
+            output, digest = self.cryo.freeze(pipe, args, digests=digests, stats=stats)
+        if self.profiler is not None:
+            self.profiler.stop(start, pipe, args, output, stats)
+        return output, digest
 
     def __repr__(self):
         if hasattr(self, 'pipelines'):
             return 'MultiPipeline: {}'.format(' || '.join([str(p) for p in self.pipelines]))
         else:
             return ' -> '.join([str(p) for p in self.pipes])
+
+
+def _fan_out(obj, n):
+    """
+    `n` independent instances of `obj`: copies of it, and `obj` itself last.
+    """
+    if n < 1:
+        return []
+    return [copy.deepcopy(obj) for _ in range(n-1)] + [obj]
@@ -1,49 +1,163 @@
 import os
-import json
-import base64
+import time
+import pickle
 import inspect
+import threading
+from collections import OrderedDict
 import numpy as np
-import scipy.sparse as sps
-from hashlib import md5
-from sklearn.externals import joblib
+from hashlib import blake2b
+from broca.pipeline.storage import MemoryStorage, LocalStorage, TieredStorage, issparse
 
 base = '/tmp/cryo/'
-if not os.path.exists(base):
-    os.makedirs(base)
 
+# Storage access is serialized across threads
+# (e.g. for pipelines with a thread executor); computing results is not
+_lock = threading.Lock()
 
-class CryoEncoder(json.JSONEncoder):
+
+class Hasher():
     """
-    For handling JSON serialization of numpy arrays and scipy sparse matrices.
-    Adapted from <http://stackoverflow.com/a/24375113>
+    Streaming content hasher.
+    Objects are fed into the hash piece by piece, so large inputs
+    (arrays, sparse matrices, long lists of documents) are never
+    serialized into a single intermediate string.
     """
-    def default(self, obj):
-        """
-        if input object is a ndarray it will be converted into a dict holding dtype, shape and the data base64 encoded
-        """
-        if isinstance(obj, np.ndarray):
-            data_b64 = base64.b64encode(obj.data).decode('utf-8')
-            return dict(__ndarray__=data_b64,
-                        dtype=str(obj.dtype),
-                        shape=obj.shape)
-        elif sps.issparse(obj):
-            data_b64 = base64.b64encode(obj.data).decode('utf-8')
-            return dict(__ndarray__=data_b64,
-                        dtype=str(obj.dtype),
-                        shape=obj.shape,
-                        indices=obj.indices,
-                        indptr=obj.indptr)
+    def __init__(self):
+        self.h = blake2b(digest_size=16)
+
+    def hexdigest(self):
+        return self.h.hexdigest()
+
+    def _tag(self, tag, size=None):
+        self.h.update(tag.encode('utf-8'))
+        if size is not None:
+            self.h.update(str(size).encode('utf-8'))
+        self.h.update(b'\x00')
+
+    def update(self, obj):
+        if isinstance(obj, str):
+            data = obj.encode('utf-8')
+            self._tag('s', len(data))
+            self.h.update(data)
+
+        elif isinstance(obj, bytes):
+            self._tag('b', len(obj))
+            self.h.update(obj)
+
+        elif obj is None or isinstance(obj, (bool, int, float)):
+            self._tag('{}:{!r}'.format(type(obj).__name__, obj))
+
+        elif isinstance(obj, np.ndarray):
+            self._tag('nd:{}:{}'.format(obj.dtype.str, obj.shape))
+            if obj.dtype.hasobject:
+                for item in obj.flat:
+                    self.update(item)
+            else:
+                # Hash the raw buffer directly
+                self.h.update(memoryview(np.ascontiguousarray(obj)).cast('B'))
+
+        elif issparse(obj):
+            if obj.format not in ('csr', 'csc'):
+                obj = obj.tocsr()
+            self._tag('sp:{}:{}'.format(obj.format, obj.shape))
+            for arr in (obj.data, obj.indices, obj.indptr):
+                self.update(arr)
+
+        elif isinstance(obj, (list, tuple)):
+            self._tag(type(obj).__name__, len(obj))
+            for item in obj:
+                self.update(item)
+
+        elif isinstance(obj, dict):
+            # Hash each item separately so that key order doesn't matter
+            self._tag('d', len(obj))
+            for d in sorted(digest_items(k, v) for k, v in obj.items()):
+                self.h.update(d)
+
+        elif isinstance(obj, (set, frozenset)):
+            self._tag('set', len(obj))
+            for d in sorted(digest_items(item) for item in obj):
+                self.h.update(d)
+
         elif hasattr(obj, '__dict__'):
-            return obj.__dict__
-        # Let the base class default method raise the TypeError
-        return json.JSONEncoder.default(self, obj)
+            cls = type(obj)
+            self._tag('o:{}.{}'.format(cls.__module__, cls.__name__))
+            self.update(obj.__dict__)
+
+        else:
+            self._tag('p')
+            self.h.update(pickle.dumps(obj, protocol=2))
+
+
+def digest_items(*objs):
+    """
+    Raw digest of a group of objects.
+    """
+    h = Hasher()
+    for obj in objs:
+        h.update(obj)
+    return h.h.digest()
+
+
+def digest(obj):
+    """
+    Content digest of an object.
+    """
+    h = Hasher()
+    h.update(obj)
+    return h.hexdigest()
+
+
+class DocsDigest(str):
+    """
+    Digest of a per-document pipe's output,
+    which also carries the digest of each document's output
+    so a following per-document pipe doesn't need to re-hash them.
+    """
+    def __new__(cls, docs):
+        obj = super().__new__(cls, digest(docs))
+        obj.docs = docs
+        return obj
+
+    def __reduce__(self):
+        return (DocsDigest, (self.docs,))
 
 
 class Cryo():
-    def __init__(self, refresh=False):
+    def __init__(self, refresh=False, storage=None):
+        """
+        `storage` is the backend results are frozen to. By default,
+        an in-process memory tier in front of a local directory under `base`.
+        """
         self.refresh = refresh
+        if storage is None:
+            storage = TieredStorage(MemoryStorage(), LocalStorage(base))
+        self.storage = storage
 
     def __call__(self, func, *args, **kwargs):
+        result, _ = self.freeze(func, args, kwargs)
+        return result
+
+    def freeze(self, func, args, kwargs=None, digests=None, stats=None):
+        """
+        Runs `func` on `args`, or thaws its previous result.
+
+        Returns the result along with its content digest,
+        which can be passed back in as `digests` for the next step so
+        it doesn't have to re-hash the same data. A `None` digest
+        means the corresponding arg is hashed here.
+
+        If a `stats` dict is passed, it's filled in with
+        whether the result was thawed (`cache`) and the time spent
+        hashing, thawing and freezing (see `broca.pipeline.profile`).
+        """
+        kwargs = kwargs or {}
+        if digests is None:
+            digests = [None for _ in args]
+        if stats is None:
+            stats = {}
+        s = time.time()
+
         # Compute the signature
         mod = inspect.getmodule(func)
         mod = mod.__name__
@@ -58,36 +172,156 @@ class Cryo():
             name = str(func)
             src = inspect.getsource(func.__call__)
 
-        meta = {
-            'mod': mod,
-            'name': name,
-            'args': args,
-            'kwargs': kwargs,
+        h = Hasher()
+        h.update(mod)
+        h.update(name)
 
-            # To see if source code changed
-            'src': src
-        }
-        meta = json.dumps(meta, sort_keys=True, cls=CryoEncoder).encode('utf-8')
-        sig = md5(meta).hexdigest()
+        # To see if source code changed
+        h.update(src)
 
-        dir = os.path.join(base, mod.replace('.', '/'), name)
-        path = os.path.join(dir, sig) + '.pkl'
+        # Pipes which process each document independently
+        # are frozen document by document, so that only new documents
+        # need to be processed
+        if self._per_doc(func, args, kwargs):
+            pipe_key = os.path.join(mod.replace('.', '/'), name, h.hexdigest())
+            stats['hash_time'] = time.time() - s
+            return self._freeze_docs(func, args, digests, pipe_key, stats)
+
+        for arg, dig in zip(args, digests):
+            h.update(dig if dig is not None else digest(arg))
+        h.update(kwargs)
+        sig = h.hexdigest()
+
+        key = os.path.join(mod.replace('.', '/'), name, sig)
+        stats['hash_time'] = time.time() - s
 
         # Thaw
-        if os.path.exists(path) and not self.refresh:
-            result = joblib.load(path)
+        s = time.time()
+        thawed = None if self.refresh else self._thaw(key)
+        stats['thaw_time'] = time.time() - s
+
+        if thawed is None:
+            # Claim the key while computing it, so that other
+            # processes (or threads) wait and thaw it instead
+            with self.storage.lock(key):
+                if not self.refresh:
+                    s = time.time()
+                    thawed = self._thaw(key)
+                    stats['thaw_time'] += time.time() - s
+                if thawed is None:
+                    result, out_digest = self._compute(func, args, kwargs, key, stats)
+
+        if thawed is not None:
+            result, out_digest = thawed
+        stats['cache'] = 'hit' if thawed is not None else 'miss'
+        return result, out_digest
+
+    def _thaw(self, key):
+        """
+        Returns the stored `(result, digest)` for `key`, or `None`.
+        """
+        with _lock:
+            try:
+                return self.storage.get(key)
+            except KeyError:
+                return None
 
+    def _compute(self, func, args, kwargs, key, stats):
+        result = func(*args, **kwargs)
+
+        # Note: this only invalidates subsequent steps
+        # if the output changes, which will automatically cause
+        # the next step to recompute (since its input changes).
+        # The output digest is stored with the result so thawing
+        # doesn't need to re-hash it.
+        # Tuple outputs get a digest per element, since they are
+        # split up across branches or expanded into args downstream.
+        s = time.time()
+        if isinstance(result, tuple):
+            out_digest = tuple(digest(r) for r in result)
         else:
-            # Compute & freeze
-            result = func(*args, **kwargs)
+            out_digest = digest(result)
+        stats['hash_time'] += time.time() - s
 
-            # Note: this only invalidates subsequent steps
-            # if the output changes, which will automatically cause
-            # the next step to recompute (since its input changes)
+        # Freeze
+        s = time.time()
+        with _lock:
+            self.storage.put(key, result, out_digest)
+        stats['freeze_time'] = time.time() - s
+        return result, out_digest
 
-            # Freeze
-            if not os.path.exists(dir):
-                os.makedirs(dir)
-            joblib.dump(result, path)
+    def _per_doc(self, func, args, kwargs):
+        return getattr(func, 'per_doc', False) \
+                and self.storage.per_doc \
+                and not kwargs \
+                and all(isinstance(arg, list) for arg in args)
 
-        return result
+    def _freeze_docs(self, func, args, digests, pipe_key, stats):
+        """
+        Runs a per-document `func` only on those documents
+        it hasn't already processed.
+        Multiple args are treated as parallel lists of documents.
+        """
+        # Digest each document
+        s = time.time()
+        arg_digests = []
+        for arg, dig in zip(args, digests):
+            docs = getattr(dig, 'docs', None)
+            if docs is None or len(docs) != len(arg):
+                docs = [digest(doc) for doc in arg]
+            arg_digests.append(docs)
+        if len(arg_digests) == 1:
+            doc_digests = arg_digests[0]
+        else:
+            doc_digests = [digest(list(ds)) for ds in zip(*arg_digests)]
+        stats['hash_time'] += time.time() - s
+
+        # Thaw
+        s = time.time()
+        with _lock:
+            found = {} if self.refresh else self.storage.get_docs(pipe_key, set(doc_digests))
+        stats['thaw_time'] = time.time() - s
+
+        # Compute & freeze the rest in a single batch,
+        # so the pipe can still parallelize over them
+        misses = OrderedDict()
+        for i, d in enumerate(doc_digests):
+            if d not in found and d not in misses:
+                misses[d] = i
+
+        if misses:
+            # Claim the pipe while computing, so that other processes (or threads)
+            # wait and thaw the documents they have in common instead
+            with self.storage.lock(pipe_key):
+                if not self.refresh:
+                    s = time.time()
+                    with _lock:
+                        found.update(self.storage.get_docs(pipe_key, set(misses)))
+                    stats['thaw_time'] += time.time() - s
+                    for d in found:
+                        misses.pop(d, None)
+
+                if misses:
+                    idx = list(misses.values())
+                    results = func(*[[arg[i] for i in idx] for arg in args])
+                    if len(results) != len(idx):
+                        raise Exception('Per-document pipe <{}> returned {} outputs for {} documents.'.format(
+                            func, len(results), len(idx)))
+
+                    s = time.time()
+                    computed = {d: (r, digest(r)) for d, r in zip(misses.keys(), results)}
+                    stats['hash_time'] += time.time() - s
+
+                    s = time.time()
+                    with _lock:
+                        self.storage.put_docs(pipe_key, computed)
+                    stats['freeze_time'] = time.time() - s
+                    found.update(computed)
+
+        stats['docs_hit'] = len(doc_digests) - len(misses)
+        stats['docs_miss'] = len(misses)
+        stats['cache'] = 'hit' if not misses else 'miss' if stats['docs_hit'] == 0 else 'partial'
+
+        result = [found[d][0] for d in doc_digests]
+        out_digest = DocsDigest([found[d][1] for d in doc_digests])
+        return result, out_digest
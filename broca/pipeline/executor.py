@@ -0,0 +1,51 @@
+"""
+Runs independent pipeline tasks (branches, sibling pipelines) concurrently.
+"""
+
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from broca.common.pool import resolve_n_jobs
+
+executors = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor
+}
+
+# Tasks running inside a worker run their own subtasks serially,
+# so nested fan-outs don't multiply the number of workers
+_local = threading.local()
+
+
+def n_workers(pipes, max_workers=None):
+    """
+    How many tasks running `pipes` can run at once within a budget of `max_workers`,
+    accounting for pipes which are themselves parallelized with `n_jobs`.
+    """
+    max_workers = max_workers or os.cpu_count() or 1
+    cost = max([resolve_n_jobs(getattr(p, 'n_jobs', 1)) for p in pipes] + [1])
+    return max(max_workers // cost, 1)
+
+
+def run_tasks(tasks, executor='serial', max_workers=1):
+    """
+    Runs a list of `(func, args)` tasks,
+    returning their results in the same order.
+    """
+    if executor not in executors and executor != 'serial':
+        raise ValueError('Unknown executor <{}>, expected one of {}.'.format(executor, ('serial',) + tuple(executors)))
+
+    if executor == 'serial' or max_workers < 2 or len(tasks) < 2 or getattr(_local, 'nested', False):
+        return [func(*args) for func, args in tasks]
+
+    with executors[executor](max_workers=min(max_workers, len(tasks))) as pool:
+        futures = [pool.submit(_run_nested, func, *args) for func, args in tasks]
+        return [f.result() for f in futures]
+
+
+def _run_nested(func, *args):
+    _local.nested = True
+    try:
+        return func(*args)
+    finally:
+        _local.nested = False
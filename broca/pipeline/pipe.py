@@ -22,6 +22,11 @@ class Pipe():
     output = None
     type = PipeTypes
 
+    # Whether the pipe processes each document independently
+    # (i.e. it maps documents to outputs one-to-one),
+    # rather than needing the whole corpus at once
+    per_doc = False
+
     def __new__(cls, *args, **kwargs):
         obj = super().__new__(cls)
         obj.args = args
@@ -54,6 +59,8 @@ class IdentityPipe(Pipe):
     i.e. when you need to pass an input unmodified to a pipe
     further along.
     """
+    per_doc = True
+
     def __init__(self, pipe_type):
         self.input = pipe_type
         self.output = pipe_type
@@ -0,0 +1,161 @@
+"""
+Profiling for pipeline runs.
+
+Each pipe run produces a record with:
+
+    - `pipe`: the pipe's signature
+    - `wall_time`, `cpu_time`: for the whole step, in seconds
+    - `hash_time`: time spent computing cache keys and output digests
+    - `thaw_time`, `freeze_time`: time spent loading from and saving to storage
+    - `compute_time`: the rest of the wall time, i.e. running the pipe itself
+    - `cache`: `hit`, `miss`, `partial` (some documents of a per-document pipe were frozen)
+      or `None` if the pipeline isn't frozen
+    - `docs_hit`, `docs_miss`: for per-document pipes, how many documents were thawed/computed
+    - `rss_delta`: how much the peak resident memory grew during the step, in bytes
+    - `input_size`, `output_size`: lengths of the inputs and output, where they have one
+
+Note that CPU time and peak memory are process-wide, so they are only
+meaningful per-pipe if the pipeline is run serially. Records aren't collected
+from pipes run with the `process` executor.
+"""
+
+import sys
+import json
+import time
+import threading
+
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+
+
+class Profiler():
+    def __init__(self, hooks=None):
+        """
+        `hooks` are callables which are called with each record as it is made,
+        e.g. to send them off to a metrics system.
+        """
+        self.hooks = hooks or []
+        self.records = []
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def start(self):
+        """
+        Starts measuring a step.
+        """
+        return {
+            'wall': time.time(),
+            'cpu': time.process_time(),
+            'rss': peak_rss()
+        }
+
+    def stop(self, start, pipe, args, output, stats):
+        """
+        Finishes measuring a step, making its record.
+        `stats` are the timings and cache info collected by `Cryo`, if any.
+        """
+        wall_time = time.time() - start['wall']
+        rss = peak_rss()
+        record = {
+            'pipe': str(pipe),
+            'wall_time': wall_time,
+            'cpu_time': time.process_time() - start['cpu'],
+            'hash_time': stats.get('hash_time', 0.),
+            'thaw_time': stats.get('thaw_time', 0.),
+            'freeze_time': stats.get('freeze_time', 0.),
+            'cache': stats.get('cache'),
+            'docs_hit': stats.get('docs_hit'),
+            'docs_miss': stats.get('docs_miss'),
+            'rss_delta': rss - start['rss'] if rss is not None else None,
+            'input_size': [size(arg) for arg in args],
+            'output_size': size(output)
+        }
+        record['compute_time'] = wall_time - record['hash_time'] - record['thaw_time'] - record['freeze_time']
+
+        with self._lock:
+            self.records.append(record)
+        for hook in self.hooks:
+            hook(record)
+        return record
+
+    def reset(self):
+        self.records = []
+
+    def to_json(self, path=None):
+        """
+        Dumps the records as JSON, optionally to a file.
+        """
+        report = json.dumps(self.records, indent=2)
+        if path is not None:
+            with open(path, 'w') as f:
+                f.write(report)
+        return report
+
+    def table(self):
+        """
+        A human-readable table of the records.
+        """
+        cols = ['pipe', 'cache', 'wall', 'cpu', 'compute', 'hash', 'thaw', 'freeze', 'rss', 'in', 'out']
+        rows = [cols]
+        for r in self.records:
+            rows.append([
+                r['pipe'] if len(r['pipe']) <= 40 else r['pipe'][:37] + '...',
+                r['cache'] or '-',
+                '{:.3f}'.format(r['wall_time']),
+                '{:.3f}'.format(r['cpu_time']),
+                '{:.3f}'.format(r['compute_time']),
+                '{:.3f}'.format(r['hash_time']),
+                '{:.3f}'.format(r['thaw_time']),
+                '{:.3f}'.format(r['freeze_time']),
+                _fmt_bytes(r['rss_delta']),
+                ','.join('-' if s is None else str(s) for s in r['input_size']),
+                '-' if r['output_size'] is None else str(r['output_size'])
+            ])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(cols))]
+        return '\n'.join(
+            '  '.join(c.ljust(w) if i == 0 else c.rjust(w) for i, (c, w) in enumerate(zip(row, widths)))
+            for row in rows)
+
+    def __str__(self):
+        return self.table()
+
+
+def peak_rss():
+    """
+    Peak resident memory of this process, in bytes.
+    """
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Reported in bytes on OSX, kilobytes on Linux
+    return rss if sys.platform == 'darwin' else rss * 1024
+
+
+def size(obj):
+    if hasattr(obj, 'shape'):
+        return obj.shape[0]
+    try:
+        return len(obj)
+    except TypeError:
+        return None
+
+
+def _fmt_bytes(n):
+    if n is None:
+        return '-'
+    for unit in ['B', 'KB', 'MB']:
+        if abs(n) < 1024:
+            return '{:.0f}{}'.format(n, unit)
+        n /= 1024
+    return '{:.1f}GB'.format(n)
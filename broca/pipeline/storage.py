@@ -0,0 +1,578 @@
+"""
+Storage backends for Cryo.
+
+A backend maps a key (a relative path like `mod/name/sig`)
+to a frozen `(result, digest)` pair.
+
+Backends with `per_doc = True` can also store results for individual documents,
+keyed by a pipe key and each document's digest (see `Cryo`).
+
+Writes are atomic (entries are written to a temporary location
+and renamed into place), and `lock(key)` lets a process claim a key
+while it computes its result, so that concurrent processes
+wait for it and thaw it rather than computing it too.
+
+Heavier dependencies (joblib, scipy) are imported only when needed,
+to keep `import broca` fast.
+"""
+
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import sqlite3
+import tempfile
+import threading
+import weakref
+import numpy as np
+from contextlib import contextmanager, ExitStack
+from collections import OrderedDict, defaultdict
+
+try:
+    import fcntl
+except ImportError: # Windows
+    fcntl = None
+
+
+def issparse(obj):
+    """
+    Checks if `obj` is a scipy sparse matrix, without importing scipy
+    (if it hasn't been imported, `obj` can't be one).
+    """
+    sps = sys.modules.get('scipy.sparse')
+    return sps is not None and sps.issparse(obj)
+
+
+class Storage():
+    """
+    Storage backends should inherit from this class
+    """
+    def get(self, key):
+        """
+        Returns the `(result, digest)` pair for `key`,
+        raising a `KeyError` if it isn't stored.
+        """
+        raise NotImplementedError
+
+    def put(self, key, result, digest):
+        raise NotImplementedError
+
+    def __contains__(self, key):
+        raise NotImplementedError
+
+    def lock(self, key):
+        """
+        Context manager which holds an exclusive lock on `key`.
+        By default this only excludes other threads of this process.
+        """
+        return _key_lock(self, key)
+
+    # Whether `get_docs` and `put_docs` are supported
+    per_doc = False
+
+    def get_docs(self, key, docs):
+        """
+        Returns a dict mapping those of the `docs` digests which are
+        stored under `key` to their `(result, digest)` pairs.
+        """
+        raise NotImplementedError
+
+    def put_docs(self, key, items):
+        """
+        Stores a dict mapping document digests to `(result, digest)` pairs under `key`.
+        """
+        raise NotImplementedError
+
+
+# Thread locks for each storage's keys. These are kept here rather than
+# on the storage itself, which must stay picklable (e.g. to be sent along
+# with a pipeline to worker processes).
+_key_locks = weakref.WeakKeyDictionary()
+_key_locks_lock = threading.Lock()
+
+
+def _key_lock(storage, key):
+    with _key_locks_lock:
+        if storage not in _key_locks:
+            _key_locks[storage] = defaultdict(threading.Lock)
+        return _key_locks[storage][key]
+
+
+class MemoryStorage(Storage):
+    """
+    In-process storage, holding at most `max_items` results,
+    `max_docs` per-document results and `max_bytes` in all
+    (least recently used ones are dropped first).
+
+    Results are kept pickled, so each thaw returns a fresh copy
+    and pipes which modify their inputs in place can't change what's stored.
+    """
+    per_doc = True
+
+    def __init__(self, max_items=16, max_docs=100000, max_bytes=512*1024**2):
+        self.max_items = max_items
+        self.max_docs = max_docs
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._docs = OrderedDict()
+        self._bytes = 0
+
+        # Orders results against per-document results,
+        # to drop whichever was used least recently when over `max_bytes`
+        self._tick = 0
+
+    def _touch(self, store, key, data=None):
+        """
+        Marks `key` as the most recently used, replacing its data if `data` is given.
+        Returns its data, or `None` if it isn't stored.
+        """
+        old = store.pop(key, None)
+        if data is None:
+            if old is None:
+                return None
+            data = old[0]
+        else:
+            if old is not None:
+                self._bytes -= len(old[0])
+            self._bytes += len(data)
+        self._tick += 1
+        store[key] = (data, self._tick)
+        return data
+
+    def _trim(self):
+        while self.max_items is not None and len(self._items) > self.max_items:
+            self._bytes -= len(self._items.popitem(last=False)[1][0])
+        while self.max_docs is not None and len(self._docs) > self.max_docs:
+            self._bytes -= len(self._docs.popitem(last=False)[1][0])
+        while self.max_bytes is not None and self._bytes > self.max_bytes:
+            oldest = [store for store in (self._items, self._docs) if store]
+            store = min(oldest, key=lambda store: next(iter(store.values()))[1])
+            self._bytes -= len(store.popitem(last=False)[1][0])
+
+    def get(self, key):
+        data = self._touch(self._items, key)
+        if data is None:
+            raise KeyError(key)
+        return pickle.loads(data)
+
+    def put(self, key, result, digest):
+        self._touch(self._items, key, pickle.dumps((result, digest), protocol=pickle.HIGHEST_PROTOCOL))
+        self._trim()
+
+    def __contains__(self, key):
+        return key in self._items
+
+    def get_docs(self, key, docs):
+        found = {}
+        for doc in docs:
+            data = self._touch(self._docs, (key, doc))
+            if data is not None:
+                found[doc] = pickle.loads(data)
+        return found
+
+    def put_docs(self, key, items):
+        for doc, item in items.items():
+            self._touch(self._docs, (key, doc), pickle.dumps(item, protocol=pickle.HIGHEST_PROTOCOL))
+        self._trim()
+
+    def size(self):
+        return self._bytes
+
+    def clear(self):
+        self._items.clear()
+        self._docs.clear()
+        self._bytes = 0
+
+
+class LocalStorage(Storage):
+    """
+    Stores each result in its own directory under `path`.
+
+    If `max_bytes` is set, entries are evicted once the total size
+    goes over it, according to `policy`:
+
+        - `lru`: least recently accessed entries go first
+        - `lfu`: least frequently accessed entries go first
+          (ties broken by recency)
+
+    Access metadata is kept in a `meta.json` file in each entry.
+
+    Arrays and CSR/CSC matrices are stored as raw `.npy` files
+    (data/indices/indptr for sparse matrices) rather than pickled.
+    If `mmap` is True, they are thawed as copy-on-write memory maps,
+    so they load in constant time and share pages across processes
+    (until a pipe modifies them in place, which doesn't touch the stored entry).
+
+    Per-document results are kept in an SQLite database, `docs.db`,
+    so that looking up and adding documents doesn't touch the others.
+    They count against `max_bytes` too, with the documents under each
+    pipe key making up a single entry (so they're evicted together).
+
+    Entries are written to a `.tmp` directory and renamed into place, so they
+    are never seen half-written. Entries which can't be loaded (e.g. if they
+    were corrupted or their size doesn't match their metadata) are removed
+    and reported as missing, so they're recomputed.
+    Keys are locked across processes with lock files in `.locks`
+    (on platforms without `fcntl`, only across threads).
+    """
+    policies = ('lru', 'lfu')
+    per_doc = True
+
+    def __init__(self, path='/tmp/cryo/', max_bytes=None, policy='lru', mmap=True):
+        if policy not in self.policies:
+            raise ValueError('Unknown eviction policy <{}>, expected one of {}.'.format(policy, self.policies))
+        self.path = path
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.mmap = mmap
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+
+    def _dir(self, key):
+        return os.path.join(self.path, key)
+
+    def get(self, key):
+        dir = self._dir(key)
+        if key not in self:
+            raise KeyError(key)
+
+        try:
+            meta = self._meta(key)
+            if _dir_size(dir) != meta['size']:
+                raise ValueError('Size mismatch')
+            result = self._load(dir)
+            with open(os.path.join(dir, 'digest'), 'r') as f:
+                digest = f.read()
+
+        # Treat an unreadable entry as missing, so it's recomputed
+        except Exception:
+            self.remove(key)
+            raise KeyError(key)
+
+        if isinstance(result, tuple):
+            digest = tuple(digest.split('\n')) if result else ()
+
+        meta['last_access'] = time.time()
+        meta['hits'] += 1
+        self._write_meta(key, meta)
+
+        return result, digest
+
+    def put(self, key, result, digest):
+        # Write the entry to a temporary directory first,
+        # then swap it into place
+        tmp = self._tmp_dir()
+        try:
+            self._dump(result, tmp)
+            with open(os.path.join(tmp, 'digest'), 'w') as f:
+                f.write(digest if isinstance(digest, str) else '\n'.join(digest))
+
+            with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+                json.dump({
+                    'size': _dir_size(tmp),
+                    'last_access': time.time(),
+                    'hits': 0
+                }, f)
+
+            dir = self._dir(key)
+            parent = os.path.dirname(dir)
+            if not os.path.exists(parent):
+                os.makedirs(parent, exist_ok=True)
+            if os.path.exists(dir):
+                old = self._tmp_dir()
+                os.rename(dir, os.path.join(old, 'old'))
+                os.rename(tmp, dir)
+                shutil.rmtree(old, ignore_errors=True)
+            else:
+                os.rename(tmp, dir)
+        except:
+            shutil.rmtree(tmp, ignore_errors=True)
+            raise
+
+        if self.max_bytes is not None:
+            self.evict(keep=key)
+
+    def _tmp_dir(self):
+        tmp = os.path.join(self.path, '.tmp')
+        if not os.path.exists(tmp):
+            os.makedirs(tmp, exist_ok=True)
+        return tempfile.mkdtemp(dir=tmp)
+
+    @contextmanager
+    def lock(self, key):
+        with _key_lock(self, key):
+            if fcntl is None:
+                yield
+                return
+
+            locks = os.path.join(self.path, '.locks')
+            if not os.path.exists(locks):
+                os.makedirs(locks, exist_ok=True)
+            with open(os.path.join(locks, key.replace(os.sep, '.')), 'w') as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __contains__(self, key):
+        return os.path.exists(os.path.join(self._dir(key), 'meta.json'))
+
+    def _dump(self, result, dir):
+        if type(result) is np.ndarray and not result.dtype.hasobject:
+            np.save(os.path.join(dir, 'result.npy'), result)
+
+        elif issparse(result) and result.format in ('csr', 'csc'):
+            for name in ('data', 'indices', 'indptr'):
+                np.save(os.path.join(dir, '{}.npy'.format(name)), getattr(result, name))
+            with open(os.path.join(dir, 'sparse.json'), 'w') as f:
+                json.dump({'format': result.format, 'shape': result.shape}, f)
+
+        else:
+            import joblib
+            joblib.dump(result, os.path.join(dir, 'result.pkl'))
+
+    def _load(self, dir):
+        mmap_mode = 'c' if self.mmap else None
+
+        path = os.path.join(dir, 'result.npy')
+        if os.path.exists(path):
+            return np.load(path, mmap_mode=mmap_mode)
+
+        path = os.path.join(dir, 'sparse.json')
+        if os.path.exists(path):
+            with open(path, 'r') as f:
+                spec = json.load(f)
+            data, indices, indptr = (np.load(os.path.join(dir, '{}.npy'.format(name)), mmap_mode=mmap_mode)
+                                     for name in ('data', 'indices', 'indptr'))
+            import scipy.sparse as sps
+            cls = sps.csr_matrix if spec['format'] == 'csr' else sps.csc_matrix
+            return cls((data, indices, indptr), shape=tuple(spec['shape']), copy=False)
+
+        import joblib
+        return joblib.load(os.path.join(dir, 'result.pkl'))
+
+    def _docs_db(self):
+        conn = sqlite3.connect(os.path.join(self.path, 'docs.db'), timeout=60)
+        # So evicted documents' pages can be given back (only takes effect on a new database)
+        conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        with conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS docs (key TEXT, doc TEXT, value BLOB, PRIMARY KEY (key, doc))')
+
+            # Access metadata for each pipe key's documents, like `meta.json` for entries
+            # (filled in from existing documents for databases which predate it)
+            exists = conn.execute('SELECT 1 FROM sqlite_master WHERE type = \'table\' AND name = \'doc_keys\'').fetchone()
+            if not exists:
+                conn.execute('CREATE TABLE doc_keys (key TEXT PRIMARY KEY, size INTEGER, last_access REAL, hits INTEGER)')
+                conn.execute('INSERT INTO doc_keys SELECT key, SUM(LENGTH(doc) + LENGTH(value)), ?, 0 FROM docs GROUP BY key', (time.time(),))
+        return conn
+
+    def _doc_batches(self, docs):
+        # Stay under SQLite's limit on query parameters
+        for i in range(0, len(docs), 500):
+            batch = docs[i:i+500]
+            yield batch, ','.join('?' for _ in batch)
+
+    def get_docs(self, key, docs):
+        docs = list(docs)
+        found = {}
+        conn = self._docs_db()
+        try:
+            for batch, params in self._doc_batches(docs):
+                rows = conn.execute('SELECT doc, value FROM docs WHERE key = ? AND doc IN ({})'.format(params), [key] + batch)
+                for doc, value in rows:
+                    # Unreadable documents are left out, so they're recomputed
+                    try:
+                        found[doc] = pickle.loads(value)
+                    except Exception:
+                        continue
+            if found:
+                with conn:
+                    conn.execute('UPDATE doc_keys SET last_access = ?, hits = hits + 1 WHERE key = ?', (time.time(), key))
+        finally:
+            conn.close()
+        return found
+
+    def put_docs(self, key, items):
+        rows = [(key, doc, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL))
+                for doc, value in items.items()]
+        size = sum(len(doc) + len(value) for _, doc, value in rows)
+        conn = self._docs_db()
+        try:
+            with conn:
+                # Don't count replaced documents twice
+                for batch, params in self._doc_batches(list(items)):
+                    replaced, = conn.execute('SELECT COALESCE(SUM(LENGTH(doc) + LENGTH(value)), 0) FROM docs WHERE key = ? AND doc IN ({})'.format(params), [key] + batch).fetchone()
+                    size -= replaced
+                conn.executemany('INSERT OR REPLACE INTO docs VALUES (?, ?, ?)', rows)
+                conn.execute('INSERT OR IGNORE INTO doc_keys VALUES (?, 0, ?, 0)', (key, time.time()))
+                conn.execute('UPDATE doc_keys SET size = size + ?, last_access = ? WHERE key = ?', (size, time.time(), key))
+        finally:
+            conn.close()
+
+        if self.max_bytes is not None:
+            self.evict(keep=key)
+
+    def _doc_entries(self):
+        """
+        Yields `(key, meta)` for each pipe key's documents.
+        """
+        if not os.path.exists(os.path.join(self.path, 'docs.db')):
+            return
+        conn = self._docs_db()
+        try:
+            rows = conn.execute('SELECT key, size, last_access, hits FROM doc_keys').fetchall()
+        finally:
+            conn.close()
+        for key, size, last_access, hits in rows:
+            yield key, {'size': size, 'last_access': last_access, 'hits': hits, 'docs': True}
+
+    def _remove_docs(self, key):
+        conn = self._docs_db()
+        try:
+            with conn:
+                conn.execute('DELETE FROM docs WHERE key = ?', (key,))
+                conn.execute('DELETE FROM doc_keys WHERE key = ?', (key,))
+            # (run as a script, since `execute` only frees a single page)
+            conn.executescript('PRAGMA incremental_vacuum')
+        finally:
+            conn.close()
+
+    def _meta(self, key):
+        with open(os.path.join(self._dir(key), 'meta.json'), 'r') as f:
+            return json.load(f)
+
+    def _write_meta(self, key, meta):
+        path = os.path.join(self._dir(key), 'meta.json')
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(meta, f)
+            os.replace(path + '.tmp', path)
+
+        # Entry removed in the meantime
+        except OSError:
+            pass
+
+    def entries(self):
+        """
+        Yields `(key, meta)` for every stored entry,
+        including each pipe key's per-document results
+        (which have `docs` set in their meta).
+        """
+        for root, dirs, files in os.walk(self.path):
+            # Skip temporary and lock directories
+            dirs[:] = [d for d in dirs if not d.startswith('.')]
+            if 'meta.json' in files:
+                key = os.path.relpath(root, self.path)
+                try:
+                    yield key, self._meta(key)
+
+                # Entry removed or half-written in the meantime
+                except (IOError, ValueError):
+                    continue
+
+        for key, meta in self._doc_entries():
+            yield key, meta
+
+    def size(self):
+        return sum(meta['size'] for key, meta in self.entries())
+
+    def remove(self, key):
+        # Move it out of the way first, so it disappears at once
+        dir = self._dir(key)
+        try:
+            old = self._tmp_dir()
+            os.rename(dir, os.path.join(old, 'old'))
+        except OSError:
+            return
+        shutil.rmtree(old, ignore_errors=True)
+
+    def evict(self, keep=None):
+        """
+        Evicts entries until the total size is within `max_bytes`.
+        The `keep` entry is evicted last, i.e. only if it alone
+        doesn't fit in the budget.
+        """
+        entries = list(self.entries())
+        total = sum(meta['size'] for key, meta in entries)
+        if total <= self.max_bytes:
+            return
+
+        if self.policy == 'lfu':
+            rank = lambda e: (e[0] == keep, e[1]['hits'], e[1]['last_access'])
+        else:
+            rank = lambda e: (e[0] == keep, e[1]['last_access'])
+
+        for key, meta in sorted(entries, key=rank):
+            if total <= self.max_bytes:
+                break
+            if meta.get('docs'):
+                self._remove_docs(key)
+            else:
+                self.remove(key)
+            total -= meta['size']
+
+
+class TieredStorage(Storage):
+    """
+    Chains storage backends, fastest first.
+    Results found in a slower tier are promoted to the faster ones.
+    """
+    def __init__(self, *tiers):
+        self.tiers = tiers
+
+    def get(self, key):
+        for i, tier in enumerate(self.tiers):
+            if key in tier:
+                result, digest = tier.get(key)
+                for faster in self.tiers[:i]:
+                    faster.put(key, result, digest)
+                return result, digest
+        raise KeyError(key)
+
+    def put(self, key, result, digest):
+        for tier in self.tiers:
+            tier.put(key, result, digest)
+
+    def __contains__(self, key):
+        return any(key in tier for tier in self.tiers)
+
+    @contextmanager
+    def lock(self, key):
+        with ExitStack() as stack:
+            for tier in self.tiers:
+                stack.enter_context(tier.lock(key))
+            yield
+
+    @property
+    def per_doc(self):
+        return any(tier.per_doc for tier in self.tiers)
+
+    def get_docs(self, key, docs):
+        found = {}
+        faster = []
+        for tier in self.tiers:
+            if not tier.per_doc:
+                continue
+            missing = [d for d in docs if d not in found]
+            if not missing:
+                break
+            thawed = tier.get_docs(key, missing)
+            if thawed:
+                # Promote them to the faster tiers
+                for f in faster:
+                    f.put_docs(key, thawed)
+                found.update(thawed)
+            faster.append(tier)
+        return found
+
+    def put_docs(self, key, items):
+        for tier in self.tiers:
+            if tier.per_doc:
+                tier.put_docs(key, items)
+
+
+def _dir_size(dir):
+    return sum(os.path.getsize(os.path.join(dir, f)) for f in os.listdir(dir) if not f.startswith('meta.json'))
@@ -0,0 +1,71 @@
+"""
+Helpers for streaming documents through a pipeline in chunks.
+
+A chunk is either a list of documents, or a tuple of such lists
+(one per branch) after a branching segment.
+"""
+
+from itertools import islice
+
+
+def chunk(docs, size):
+    """
+    Splits an iterable of documents into lists of `size` documents.
+    """
+    docs = iter(docs)
+    while True:
+        chunk = list(islice(docs, size))
+        if not chunk:
+            break
+        yield chunk
+
+
+def concat(chunks):
+    """
+    Materializes a stream of chunks into a single input.
+    """
+    chunks = iter(chunks)
+    try:
+        first = next(chunks)
+    except StopIteration:
+        return []
+
+    if isinstance(first, tuple):
+        outputs = tuple(list(c) for c in first)
+        for c in chunks:
+            for output, c_ in zip(outputs, c):
+                output.extend(c_)
+        return outputs
+
+    output = list(first)
+    for c in chunks:
+        output.extend(c)
+    return output
+
+
+def rechunk(output, size):
+    """
+    Splits a materialized output (anything that supports `len` and slicing,
+    or a tuple of such outputs) back into chunks.
+    """
+    if isinstance(output, tuple):
+        n = len(output[0]) if output else 0
+        for i in range(0, n, size):
+            yield tuple(o[i:i+size] for o in output)
+    else:
+        for i in range(0, len(output), size):
+            yield output[i:i+size]
+
+
+def unchunk(chunks):
+    """
+    Yields individual documents from a stream of chunks.
+    Documents of branched chunks are yielded as tuples.
+    """
+    for c in chunks:
+        if isinstance(c, tuple):
+            for doc in zip(*c):
+                yield doc
+        else:
+            for doc in c:
+                yield doc
@@ -4,6 +4,7 @@ from broca import Pipe
 class PreProcessor(Pipe):
     input = Pipe.type.docs
     output = Pipe.type.docs
+    per_doc = True
 
     def __call__(self, docs):
         return self.preprocess(docs)
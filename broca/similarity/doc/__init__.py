@@ -21,5 +21,9 @@ class DocSimilarity(Pipe):
         raise NotImplementedError
 
 
-from .wikipedia import WikipediaSimilarity
-from .entkey import EntKeySimilarity
+from broca.common.lazy import lazy_import
+
+__getattr__, __dir__ = lazy_import(__name__, {
+    'WikipediaSimilarity': '.wikipedia',
+    'EntKeySimilarity': '.entkey'
+})
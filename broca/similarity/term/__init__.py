@@ -18,4 +18,8 @@ class TermSimilarity():
         raise NotImplementedError
 
 
-from .wikipedia import WikipediaSimilarity
+from broca.common.lazy import lazy_import
+
+__getattr__, __dir__ = lazy_import(__name__, {
+    'WikipediaSimilarity': '.wikipedia'
+})
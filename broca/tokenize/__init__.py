@@ -12,4 +12,8 @@ class Tokenizer(Pipe):
         raise NotImplementedError
 
 
-from .lemma import LemmaTokenizer
+from broca.common.lazy import lazy_import
+
+__getattr__, __dir__ = lazy_import(__name__, {
+    'LemmaTokenizer': '.lemma'
+})
@@ -3,7 +3,13 @@ Keyword extraction methods.
 These accept lists of strings as arguments.
 """
 
-from .pos import POSTokenizer
-from .rake import RAKETokenizer
-from .apriori import AprioriTokenizer
-from .overkill import OverkillTokenizer
+from broca.common.lazy import lazy_import
+
+__all__ = ['POSTokenizer', 'RAKETokenizer', 'AprioriTokenizer', 'OverkillTokenizer']
+
+__getattr__, __dir__ = lazy_import(__name__, {
+    'POSTokenizer': '.pos',
+    'RAKETokenizer': '.rake',
+    'AprioriTokenizer': '.apriori',
+    'OverkillTokenizer': '.overkill'
+})
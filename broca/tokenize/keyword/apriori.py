@@ -5,9 +5,14 @@ The original apriori algorithm was mainly for looking at "baskets" (i.e. shoppin
 so some terminology may seem weird here. In particular, "transaction" refers to the set of tokens for a document.
 
 See <https://en.wikipedia.org/wiki/Apriori_algorithm>
+
+Rather than generating and counting candidates level by level,
+frequent sets are mined depth-first over "tid-lists" (Eclat):
+each item is mapped to the set of transactions it occurs in, as a bitset
+(a Python int), and an itemset's support is the size of the intersection
+of its items' bitsets.
 """
 
-from itertools import combinations
 from collections import defaultdict
 from broca.tokenize.keyword import POSTokenizer
 from broca.tokenize.util import prune
@@ -37,25 +42,13 @@ class AprioriTokenizer(Tokenizer):
         if self.min_sup < 1/len(docs):
             raise Exception('`min_sup` must be greater than or equal to `1/len(docs)`.')
 
-        # First pass
-        candidates = set()
-        transactions = []
-
         # Use nouns and noun phrases.
-        for doc in POSTokenizer().tokenize(docs):
-            transaction = set(doc)
-            candidates = candidates.union({(t,) for t in transaction})
-            transactions.append(transaction)
-        freq_set = filter_support(candidates, transactions, self.min_sup)
-
-        # Iterate
-        k = 2
-        last_set = set()
-        while freq_set != set():
-            last_set = freq_set
-            cands = generate_candidates(freq_set, k)
-            freq_set = filter_support(cands, transactions, self.min_sup)
-            k += 1
+        transactions = [set(doc) for doc in POSTokenizer().tokenize(docs)]
+
+        # Keep the largest frequent sets
+        freq_sets = frequent_sets(transactions, self.min_sup)
+        k = max(map(len, freq_sets), default=0)
+        last_set = sorted(s for s in freq_sets if len(s) == k)
 
         # Map documents to their keywords.
         keywords = flatten(last_set)
@@ -69,37 +62,34 @@ def flatten(nested_tuple):
     return tuple([el for tupl in nested_tuple for el in tupl])
 
 
-def filter_support(candidates, transactions, min_sup):
+def frequent_sets(transactions, min_sup):
     """
-    Filter candidates to a frequent set by some minimum support.
+    Finds all sets of items whose support (the ratio of transactions
+    they occur in) is at least `min_sup`, as sorted tuples.
     """
-    counts = defaultdict(lambda: 0)
-    for transaction in transactions:
-        for c in (c for c in candidates if set(c).issubset(transaction)):
-            counts[c] += 1
-    return {i for i in candidates if counts[i]/len(transactions) >= min_sup}
+    n = len(transactions)
+    tids = defaultdict(int)
+    for i, transaction in enumerate(transactions):
+        bit = 1 << i
+        for item in transaction:
+            tids[item] |= bit
+
+    def frequent(tid):
+        return bin(tid).count('1')/n >= min_sup
+
+    freq_sets = []
+
+    # Extend the itemset `prefix` with each of `items`, which are
+    # `(item, tids)` pairs already known to be frequent with the prefix
+    def extend(prefix, items):
+        for i, (item, tid) in enumerate(items):
+            itemset = prefix + (item,)
+            freq_sets.append(itemset)
+            suffix = [(item_, tid & tid_) for item_, tid_ in items[i+1:]]
+            suffix = [(item_, tid_) for item_, tid_ in suffix if frequent(tid_)]
+            if suffix:
+                extend(itemset, suffix)
+
+    extend((), sorted((item, tid) for item, tid in tids.items() if frequent(tid)))
+    return freq_sets
 
-
-def generate_candidates(freq_set, k):
-    """
-    Generate candidates for an iteration.
-    Use this only for k >= 2.
-    """
-    single_set = {(i,) for i in set(flatten(freq_set))}
-
-    # TO DO generating all combinations gets very slow for large documents.
-    # Is there a way of doing this without exhaustively searching all combinations?
-    cands = [flatten(f) for f in combinations(single_set, k)]
-    return [cand for cand in cands if validate_candidate(cand, freq_set, k)]
-
-
-def validate_candidate(candidate, freq_set, k):
-    """
-    Checks if we should keep a candidate.
-    We keep a candidate if all its k-1-sized subsets
-    are present in the frequent sets.
-    """
-    for subcand in combinations(candidate, k-1):
-        if subcand not in freq_set:
-            return False
-    return True
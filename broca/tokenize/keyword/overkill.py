@@ -1,76 +1,145 @@
+import os
+import json
+import tempfile
 from functools import partial
 from broca.tokenize import Tokenizer
-from broca.common.shared import spacy
+from broca.annotate import annotate, annotate_docs
 from broca.common.util import parallel, penn_to_wordnet
+from broca.pipeline.stream import chunk
 from broca.tokenize.keyword.rake import RAKETokenizer
 from gensim.models import Phrases
-from nltk.stem.wordnet import WordNetLemmatizer
 
 
 class OverkillTokenizer(Tokenizer):
-    def __init__(self, lemmatize=True, n_jobs=1, bigram=None, trigram=None, min_count=5, threshold=10.):
+    """
+    Extracts keywords with RAKE, keeps their lemmatized nouns, verbs, adjectives and adverbs,
+    and then learns bigram and trigram phrases over them.
+
+    Docs are processed `chunk_size` at a time and their tokens are spilled to
+    a temporary file, which the phrase models are trained from, so memory use
+    is bounded by the chunk size and the phrase models' vocabularies.
+    The phrase models prune their vocabularies once they exceed `max_vocab_size`.
+
+    If `model_path` is set, the trained phrase models are saved to that directory.
+    If models are already saved there, they are loaded and only applied,
+    not trained further.
+    """
+    def __init__(self, lemmatize=True, n_jobs=1, bigram=None, trigram=None, min_count=5, threshold=10.,
+                 batch_size=1000, n_threads=2, chunk_size=10000, max_vocab_size=40000000, model_path=None):
         self.lemmatize = lemmatize
         self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.n_threads = n_threads
         self.bigram = bigram
         self.trigram = trigram
         self.min_count = min_count
         self.threshold = threshold
+        self.chunk_size = chunk_size
+        self.max_vocab_size = max_vocab_size
+        self.model_path = model_path
 
     def tokenize(self, docs):
-        if self.lemmatize:
-            lem = WordNetLemmatizer()
+        if self._load():
+            return self._apply(self._pre_tokenize(docs))
 
-        #print('RAKE tokenizing...')
-        pre_tdocs = RAKETokenizer(n_jobs=self.n_jobs).tokenize(docs)
+        with tempfile.TemporaryFile(mode='w+') as f:
+            tdocs = _Spilled(f, self._pre_tokenize(docs))
+            self._train(tdocs)
+            self._save()
+            return self._apply(tdocs)
 
-        for i, tdoc in enumerate(pre_tdocs):
-            for t in tdoc:
-                if t.startswith('one'):
-                    print(t)
-                    print(i)
+    def _apply(self, tdocs):
+        # Phrase models are applied doc by doc,
+        # since they peek into (and so consume part of) a corpus given as a generator
+        return [self.trigram[self.bigram[tdoc]] for tdoc in tdocs]
 
-        #print('Additional Tokenizing docs...')
-        if self.n_jobs == 1:
-            tdocs = [pre_tokenize(doc, tdoc, lem=lem) for doc, tdoc in zip(docs, pre_tdocs)]
-        else:
-            tdocs = parallel(partial(pre_tokenize, lem=lem), zip(docs, pre_tdocs), self.n_jobs, expand_args=True)
+    def _pre_tokenize(self, docs):
+        for docs_ in chunk(docs, self.chunk_size):
+            docs_ = annotate_docs(docs_, batch_size=self.batch_size, n_threads=self.n_threads)
+            pre_tdocs = RAKETokenizer(n_jobs=self.n_jobs).tokenize(docs_)
+
+            if self.n_jobs == 1:
+                tdocs = [pre_tokenize(doc, tdoc, lemmatize=self.lemmatize) for doc, tdoc in zip(docs_, pre_tdocs)]
+            else:
+                tdocs = parallel(partial(pre_tokenize, lemmatize=self.lemmatize), zip(docs_, pre_tdocs), self.n_jobs,
+                                 expand_args=True, warmup=('wordnet',) if self.lemmatize else ())
+
+            for tdoc in tdocs:
+                yield tdoc
 
-        #print('Training bigram...')
+    def _train(self, tdocs):
         if self.bigram is None:
             self.bigram = Phrases(tdocs,
                                   min_count=self.min_count,
                                   threshold=self.threshold,
+                                  max_vocab_size=self.max_vocab_size,
                                   delimiter=b' ')
         else:
             self.bigram.add_vocab(tdocs)
 
-        #print('Training trigram...')
         if self.trigram is None:
             self.trigram = Phrases(self.bigram[tdocs],
                                    min_count=self.min_count,
                                    threshold=self.threshold,
+                                   max_vocab_size=self.max_vocab_size,
                                    delimiter=b' ')
         else:
             self.trigram.add_vocab(self.bigram[tdocs])
 
-        return [tdoc for tdoc in self.trigram[self.bigram[tdocs]]]
+    def _paths(self):
+        return [os.path.join(self.model_path, name) for name in ['bigram.phrases', 'trigram.phrases']]
+
+    def _load(self):
+        """
+        Loads the saved phrase models, if there are any.
+        """
+        if self.model_path is None or not all(os.path.exists(p) for p in self._paths()):
+            return False
+        bigram_path, trigram_path = self._paths()
+        self.bigram = Phrases.load(bigram_path)
+        self.trigram = Phrases.load(trigram_path)
+        return True
+
+    def _save(self):
+        if self.model_path is None:
+            return
+        if not os.path.exists(self.model_path):
+            os.makedirs(self.model_path)
+        for model, path in zip([self.bigram, self.trigram], self._paths()):
+            model.save(path)
+
+
+class _Spilled():
+    """
+    Writes tokenized docs to a file as they come in,
+    and streams them back from it on each iteration.
+    """
+    def __init__(self, f, tdocs):
+        self.f = f
+        for tdoc in tdocs:
+            f.write(json.dumps(tdoc))
+            f.write('\n')
+
+    def __iter__(self):
+        self.f.seek(0)
+        for line in self.f:
+            yield json.loads(line)
 
 
-def pre_tokenize(doc, tdoc, lem):
+def pre_tokenize(doc, tdoc, lemmatize=True):
     # Split phrase keywords into 1gram keywords,
     # to check tokens against
     # We learn keyphrases later on.
-    kws_1g = [t.split(' ') for t in tdoc]
-    kws_1g = [kw for grp in kws_1g for kw in grp]
+    kws_1g = set(kw for t in tdoc for kw in t.split(' '))
 
-    toks = spacy(doc, tag=True, parse=False, entity=False)
-    tagged = [(t.lower_.strip(), t.tag_) for t in toks]
+    doc = annotate(doc)
+    lemmas = doc.lemmas if lemmatize else doc.tokens
 
     toks = []
-    for tok, tag in tagged:
+    for tok, tag, lemma in zip(doc.tokens, doc.tags, lemmas):
         if tok in kws_1g:
             wn_tag = penn_to_wordnet(tag)
             if wn_tag is not None:
-                toks.append(lem.lemmatize(tok, wn_tag))
+                toks.append(lemma)
 
     return toks
@@ -7,7 +7,7 @@ See <http://stevenloria.com/tutorial-state-of-the-art-part-of-speech-tagging-in-
 However, it complicates the library's installation, and the spacy tagger is quite fast and good too.
 """
 
-from broca.common.shared import spacy
+from broca.annotate import annotate_docs
 from broca.tokenize import Tokenizer
 from broca.tokenize.util import prune
 
@@ -21,13 +21,16 @@ CFG = {
 
 
 class POSTokenizer(Tokenizer):
+    def __init__(self, batch_size=1000, n_threads=2):
+        self.batch_size = batch_size
+        self.n_threads = n_threads
+
     def tokenize(self, docs):
         tags = ['NN', 'NNS', 'NNP', 'NNPS']
 
         keywords = []
-        for doc in docs:
-            toks = spacy(doc, tag=True, parse=False, entity=False)
-            tagged = [(t.lower_.strip(), t.tag_) for t in toks]
+        for doc in annotate_docs(docs, batch_size=self.batch_size, n_threads=self.n_threads):
+            tagged = list(zip(doc.tokens, doc.tags))
             kws = [t for t, tag in tagged if tag in tags]
             kws += extract_noun_phrases(tagged)
             keywords.append(kws)
@@ -37,26 +40,24 @@ class POSTokenizer(Tokenizer):
 def extract_noun_phrases(tagged_doc):
     """
     (From textblob)
+
+    Merges adjacent tokens according to `CFG`, always merging
+    the leftmost mergeable pair first. This is done in a single pass
+    with a stack: the tokens on the stack can't be merged with one another,
+    so the leftmost mergeable pair can only involve the top of the stack
+    and the next token (or what they merge into).
     """
-    tags = _normalize_tags(tagged_doc)
-    merge = True
-    while merge:
-        merge = False
-        for x in range(0, len(tags) - 1):
-            t1 = tags[x]
-            t2 = tags[x + 1]
-            key = t1[1], t2[1]
-            value = CFG.get(key, '')
-            if value:
-                merge = True
-                tags.pop(x)
-                tags.pop(x)
-                match = '%s %s' % (t1[0], t2[0])
-                pos = value
-                tags.insert(x, (match, pos))
+    stack = []
+    for tok in _normalize_tags(tagged_doc):
+        while stack:
+            value = CFG.get((stack[-1][1], tok[1]))
+            if not value:
                 break
+            prev = stack.pop()
+            tok = ('%s %s' % (prev[0], tok[0]), value)
+        stack.append(tok)
 
-    matches = [t[0] for t in tags if t[1] in ['NNP', 'NNI']]
+    matches = [t[0] for t in stack if t[1] in ['NNP', 'NNI']]
     return matches
 
 
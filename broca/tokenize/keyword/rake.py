@@ -15,32 +15,43 @@ as well as the ability to set frequency and phrase length parameters
 important when dealing with longer documents
 """
 
-import os
 import re
 import operator
-from nltk.corpus import stopwords
+import threading
+from collections import Counter
 from broca.tokenize import Tokenizer
 from broca.common.util import parallel
+from broca.common.stopwords import stopwords, stopwords_list, smart_stoplist
 
-stops_path = os.path.join(os.path.dirname(__file__),
-                '../../data/SmartStoplist.txt')
+stops_path = smart_stoplist
 
 
 class RAKETokenizer(Tokenizer):
+    per_doc = True
+
     def __init__(self, n_jobs=1):
         self.n_jobs = n_jobs
 
     def tokenize(self, docs):
-        stops = stopwords.words('english')
-        r = Rake(stops_path)
+        stops = stopwords('english')
+        r = Rake.shared(stops_path)
 
         if self.n_jobs == 1:
-            keywords = [[kw[0] for kw in r.run(doc) if kw not in stops] for doc in docs]
+            keywords = [[kw[0] for kw in r.run(doc) if kw[0] not in stops] for doc in docs]
         else:
-            keywords = [[kw[0] for kw in kwd if kw not in stops] for kwd in parallel(r.run, docs, self.n_jobs)]
+            keywords = [[kw[0] for kw in kwd if kw[0] not in stops] for kwd in parallel(_run, docs, self.n_jobs, warmup=('rake',))]
         return keywords
 
 
+def _run(doc):
+    return Rake.shared(stops_path).run(doc)
+
+
+# Compiled once, rather than on every call
+splitter = re.compile('[^a-zA-Z0-9_\\+\\-/]')
+sentence_delimiters = re.compile(u'[\\[\\]\n.!?,;:\t\\-\\"\\(\\)\\\'\u2019\u2013]')
+
+
 def is_number(s):
     try:
         float(s) if '.' in s else int(s)
@@ -55,12 +66,7 @@ def load_stop_words(stop_word_file):
     @param stop_word_file Path and file name of a file containing stop words.
     @return list A list of stop words.
     """
-    stop_words = []
-    for line in open(stop_word_file):
-        if line.strip()[0:1] != "#":
-            for word in line.split():  # in case more than one per line
-                stop_words.append(word)
-    return stop_words
+    return list(stopwords_list(stop_word_file))
 
 
 def separate_words(text, min_word_return_size):
@@ -69,7 +75,6 @@ def separate_words(text, min_word_return_size):
     @param text The text that must be split in to words.
     @param min_word_return_size The minimum no of characters a word must have to be included.
     """
-    splitter = re.compile('[^a-zA-Z0-9_\\+\\-/]')
     words = []
     for single_word in splitter.split(text):
         current_word = single_word.strip().lower()
@@ -84,25 +89,69 @@ def split_sentences(text):
     Utility function to return a list of sentences.
     @param text The text that must be split in to sentences.
     """
-    sentence_delimiters = re.compile(u'[\\[\\]\n.!?,;:\t\\-\\"\\(\\)\\\'\u2019\u2013]')
     sentences = sentence_delimiters.split(text)
     return sentences
 
 
+_stop_word_regexes = {}
+_stop_word_regexes_lock = threading.Lock()
+
+
 def build_stop_word_regex(stop_word_file_path):
-    stop_word_list = load_stop_words(stop_word_file_path)
-    stop_word_regex_list = []
-    for word in stop_word_list:
-        word_regex = '\\b' + word + '\\b'
-        stop_word_regex_list.append(word_regex)
-    stop_word_pattern = re.compile('|'.join(stop_word_regex_list), re.IGNORECASE)
-    return stop_word_pattern
+    """
+    Compiles a regex matching any of the stop words in a file
+    (matching the same as `\\bword1\\b|\\bword2\\b|...`).
+    These are compiled once per file and process, since there are many.
+    """
+    with _stop_word_regexes_lock:
+        if stop_word_file_path not in _stop_word_regexes:
+            stop_word_list = stopwords_list(stop_word_file_path)
+            pattern = _trie_pattern(stop_word_list)
+            if pattern is None:
+                pattern = '\\b(?:' + '|'.join(stop_word_list) + ')\\b'
+            _stop_word_regexes[stop_word_file_path] = re.compile(pattern, re.IGNORECASE)
+        return _stop_word_regexes[stop_word_file_path]
+
+
+def _trie_pattern(words):
+    """
+    Builds a regex of the words as a trie, which is much faster to match
+    than an alternation of every word.
+
+    An alternation prefers the first listed word which matches,
+    whereas the trie prefers the shortest one (its optional branches are lazy),
+    so this is only equivalent if no word is listed after a word it's a prefix of.
+    Returns `None` otherwise, or if the words aren't plain lowercase words.
+    """
+    seen = set()
+    for word in words:
+        if not re.match("[a-z0-9']+$", word):
+            return None
+        if any(w.startswith(word) and w != word for w in seen):
+            return None
+        seen.add(word)
+
+    trie = {}
+    for word in words:
+        node = trie
+        for c in word:
+            node = node.setdefault(c, {})
+        node[''] = {}
+
+    def build(node):
+        alts = [re.escape(c) + build(child) for c, child in sorted(node.items()) if c]
+        if not alts:
+            return ''
+        body = alts[0] if len(alts) == 1 else '(?:' + '|'.join(alts) + ')'
+        return '(?:' + body + ')??' if '' in node else body
+
+    return '\\b(?:' + build(trie) + ')\\b'
 
 
 def generate_candidate_keywords(sentence_list, stopword_pattern, min_char_length=1, max_words_length=5):
     phrase_list = []
     for s in sentence_list:
-        tmp = re.sub(stopword_pattern, '|', s.strip())
+        tmp = stopword_pattern.sub('|', s.strip())
         phrases = tmp.split("|")
         for phrase in phrases:
             phrase = phrase.strip().lower()
@@ -140,49 +189,58 @@ def is_acceptable(phrase, min_char_length, max_words_length):
     return 1
 
 
-def calculate_word_scores(phraseList):
-    word_frequency = {}
-    word_degree = {}
+def calculate_word_scores(phraseList, phrase_words=None):
+    """
+    `phrase_words` optionally maps each phrase to its words,
+    so they're only separated once.
+    """
+    if phrase_words is None:
+        phrase_words = {phrase: separate_words(phrase, 0) for phrase in phraseList}
+    word_frequency = Counter()
+    word_degree = Counter()
     for phrase in phraseList:
-        word_list = separate_words(phrase, 0)
+        word_list = phrase_words[phrase]
         word_list_length = len(word_list)
         word_list_degree = word_list_length - 1
         #if word_list_degree > 3: word_list_degree = 3 #exp.
         for word in word_list:
-            word_frequency.setdefault(word, 0)
             word_frequency[word] += 1
-            word_degree.setdefault(word, 0)
             word_degree[word] += word_list_degree  #orig.
             #word_degree[word] += 1/(word_list_length*1.0) #exp.
-    for item in word_frequency:
-        word_degree[item] = word_degree[item] + word_frequency[item]
 
     # Calculate Word scores = deg(w)/frew(w)
     word_score = {}
-    for item in word_frequency:
-        word_score.setdefault(item, 0)
-        word_score[item] = word_degree[item] / (word_frequency[item] * 1.0)  #orig.
+    for item, freq in word_frequency.items():
+        word_score[item] = (word_degree[item] + freq) / (freq * 1.0)  #orig.
     #word_score[item] = word_frequency[item]/(word_degree[item] * 1.0) #exp.
     return word_score
 
 
-def generate_candidate_keyword_scores(phrase_list, word_score, min_keyword_frequency=1):
-    keyword_candidates = {}
+def generate_candidate_keyword_scores(phrase_list, word_score, min_keyword_frequency=1, phrase_words=None):
+    if phrase_words is None:
+        phrase_words = {phrase: separate_words(phrase, 0) for phrase in phrase_list}
+    phrase_counts = Counter(phrase_list) if min_keyword_frequency > 1 else None
 
+    keyword_candidates = {}
     for phrase in phrase_list:
-        if min_keyword_frequency > 1:
-            if phrase_list.count(phrase) < min_keyword_frequency:
-                continue
-        keyword_candidates.setdefault(phrase, 0)
-        word_list = separate_words(phrase, 0)
+        if phrase in keyword_candidates:
+            continue
+        if phrase_counts is not None and phrase_counts[phrase] < min_keyword_frequency:
+            continue
         candidate_score = 0
-        for word in word_list:
+        for word in phrase_words[phrase]:
             candidate_score += word_score[word]
         keyword_candidates[phrase] = candidate_score
     return keyword_candidates
 
 
 class Rake(object):
+    """
+    A RAKE engine. Its stop word regex is compiled once,
+    so reuse the engine (see `Rake.shared`) rather than creating one per call.
+    """
+    _shared = {}
+
     def __init__(self, stop_words_path, min_char_length=1, max_words_length=5, min_keyword_frequency=1):
         self.__stop_words_path = stop_words_path
         self.__stop_words_pattern = build_stop_word_regex(stop_words_path)
@@ -190,14 +248,30 @@ class Rake(object):
         self.__max_words_length = max_words_length
         self.__min_keyword_frequency = min_keyword_frequency
 
+    @classmethod
+    def shared(cls, stop_words_path, **kwargs):
+        """
+        The engine for these settings shared by this process.
+        """
+        key = (stop_words_path,) + tuple(sorted(kwargs.items()))
+        if key not in cls._shared:
+            cls._shared[key] = cls(stop_words_path, **kwargs)
+        return cls._shared[key]
+
     def run(self, text):
         sentence_list = split_sentences(text)
 
         phrase_list = generate_candidate_keywords(sentence_list, self.__stop_words_pattern, self.__min_char_length, self.__max_words_length)
 
-        word_scores = calculate_word_scores(phrase_list)
+        # Separate each distinct phrase's words once
+        phrase_words = {}
+        for phrase in phrase_list:
+            if phrase not in phrase_words:
+                phrase_words[phrase] = separate_words(phrase, 0)
+
+        word_scores = calculate_word_scores(phrase_list, phrase_words)
 
-        keyword_candidates = generate_candidate_keyword_scores(phrase_list, word_scores, self.__min_keyword_frequency)
+        keyword_candidates = generate_candidate_keyword_scores(phrase_list, word_scores, self.__min_keyword_frequency, phrase_words)
 
         sorted_keywords = sorted(keyword_candidates.items(), key=operator.itemgetter(1), reverse=True)
         return sorted_keywords
@@ -1,49 +1,65 @@
-from nltk.stem.wordnet import WordNetLemmatizer
-from nltk.corpus import stopwords
+from functools import partial
 from broca.tokenize import Tokenizer
-from broca.common.shared import spacy
-from broca.common.util import penn_to_wordnet, parallel
+from broca.annotate import annotate, annotate_docs
+from broca.common.lemma import shared_cache
+from broca.common.stopwords import stopwords
+from broca.common.util import parallel
 
 
 class LemmaTokenizer(Tokenizer):
     """
     Lemmatizing tokenizer.
+    Docs are parsed in batches of `batch_size` with `n_threads` threads,
+    and then lemmatized with `n_jobs`.
+
+    Lemmas are memoized in a cache shared across documents
+    (see `broca.common.lemma`). If `lemma_cache` is a path, the cache
+    is loaded from and saved back to it, so it stays warm across runs.
     """
-    def __init__(self, n_jobs=1):
-        self.lemmr = WordNetLemmatizer()
-        self.stops = stopwords.words('english')
+    per_doc = True
+
+    def __init__(self, n_jobs=1, batch_size=1000, n_threads=2, lemma_cache=None):
+        self.stops = stopwords('english')
         self.n_jobs = n_jobs
+        self.batch_size = batch_size
+        self.n_threads = n_threads
+        self.lemma_cache = lemma_cache
 
     def tokenize(self, docs):
         """ Tokenizes a document, using a lemmatizer.
 
         Args:
-            | doc (str)                 -- the text document to process.
+            | doc (str)                 -- the text document to process,
+                                           which may be annotated (see `broca.annotate`).
 
         Returns:
             | list                      -- the list of tokens.
         """
+        docs = annotate_docs(docs, batch_size=self.batch_size, n_threads=self.n_threads)
+        cache = shared_cache(self.lemma_cache)
         if self.n_jobs == 1:
-            return [self._tokenize(doc) for doc in docs]
+            toks = [_tokenize(doc, self.lemma_cache) for doc in docs]
         else:
-            return parallel(self._tokenize, docs, self.n_jobs)
-
-    def _tokenize(self, doc):
-        toks = []
-
-        for t in spacy(doc, tag=True, parse=False, entity=False):
-            token = t.lower_.strip()
-            tag = t.tag_
-
-            # Ignore stopwords
-            if token in self.stops:
-                continue
-
-            # Lemmatize
-            wn_tag = penn_to_wordnet(tag)
-            if wn_tag is not None:
-                lemma = self.lemmr.lemmatize(token, wn_tag)
-                toks.append(lemma)
-            else:
-                toks.append(token)
+            # Lemmas cached in the worker processes
+            # are merged into this process' cache
+            toks = []
+            results = parallel(partial(_tokenize_job, lemma_cache=self.lemma_cache), docs, self.n_jobs, warmup=('wordnet',))
+            for doc_toks, lemmas in results:
+                toks.append(doc_toks)
+                cache.update(lemmas)
+
+        if self.lemma_cache is not None:
+            cache.save()
         return toks
+
+
+def _tokenize_job(doc, lemma_cache=None):
+    toks = _tokenize(doc, lemma_cache)
+    return toks, shared_cache(lemma_cache).drain()
+
+
+def _tokenize(doc, lemma_cache=None):
+    # Stopwords are dropped before lemmatizing, so their lemmas aren't looked up
+    # (tokens without a WordNet PoS, like punctuation, are kept as they are)
+    doc = annotate(doc)
+    return list(doc.lemmatize(shared_cache(lemma_cache), skip=stopwords('english')))
@@ -1,3 +1,4 @@
+from collections import Counter
 from broca.common.util import gram_size
 
 
@@ -18,20 +19,36 @@ def prune(tdocs):
             terms.add(t)
 
     # Identify candidates for redundant terms (1-gram terms found in a phrase)
+    in_terms = _Substrings(terms)
     redundant = set()
-    for t in terms:
-        if any(t in ph for ph in phrases):
-            redundant.add(t)
+    for ph in phrases:
+        redundant |= in_terms(ph)
 
     # Search all documents to check that these terms occur
     # only in a phrase. If not, remove it as a candidate.
-    # This could be more efficient
-    cleared = set()
-    for t in redundant:
-        if any(check_term(d, term=t) for d in tdocs):
-            cleared.add(t)
+    # A term is cleared if, in some document, it occurs more often
+    # than the terms (phrases or not) which contain it.
+    in_redundant = _Substrings(redundant)
+    pending = set(redundant)
+    for doc in tdocs:
+        if not pending:
+            break
+        candidates = pending.intersection(doc)
+        if not candidates:
+            continue
+
+        counts = Counter(doc)
+        containing = Counter()
+        for t, n in counts.items():
+            for t_ in in_redundant(t):
+                if t_ in candidates:
+                    containing[t_] += n
+
+        for t in candidates:
+            if counts[t] > containing[t]:
+                pending.discard(t)
 
-    redundant = redundant.difference(cleared)
+    redundant = pending
 
     pruned_tdocs = []
     for doc in tdocs:
@@ -40,6 +57,34 @@ def prune(tdocs):
     return pruned_tdocs
 
 
+class _Substrings():
+    """
+    Finds which of a set of 1-gram terms are substrings of a given term
+    (other than the term itself), memoized per term.
+
+    Since 1-gram terms have no spaces, they can only be found
+    within the space-separated pieces of a term, so it's enough
+    to look up those pieces' substrings, up to the longest term's length.
+    """
+    def __init__(self, terms):
+        self.terms = terms
+        self.max_len = max(map(len, terms), default=0)
+        self._memo = {}
+
+    def __call__(self, term):
+        found = self._memo.get(term)
+        if found is None:
+            m = self.max_len
+            subs = {''}
+            for piece in set(term.split(' ')):
+                n = len(piece)
+                subs.update(piece[i:j] for i in range(n) for j in range(i + 1, min(n, i + m) + 1))
+            found = self.terms.intersection(subs)
+            found.discard(term)
+            self._memo[term] = found
+        return found
+
+
 def check_term(tdoc, term):
     if term not in tdoc:
         return False
@@ -33,5 +33,9 @@ class Vectorizer(Pipe):
         return self.vectorize(docs)
 
 
-from .bow import BoWVectorizer
-from .dcs import DCSVectorizer
+from broca.common.lazy import lazy_import
+
+__getattr__, __dir__ = lazy_import(__name__, {
+    'BoWVectorizer': '.bow',
+    'DCSVectorizer': '.dcs'
+})
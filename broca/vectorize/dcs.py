@@ -41,16 +41,13 @@ Notes:
 
 import math
 import numpy as np
-from nltk.corpus import stopwords
 from nltk.corpus import wordnet as wn
 from scipy.sparse.csgraph import connected_components
 from broca.distance.sift4 import sift4
 from broca.vectorize import Vectorizer
 from broca.common.util import penn_to_wordnet
-from broca.common.shared import spacy
-
-
-stops = stopwords.words('english')
+from broca.annotate import annotate, annotate_docs
+from broca.common.stopwords import stopwords
 
 
 class DCSVectorizer(Vectorizer):
@@ -64,6 +61,8 @@ class DCSVectorizer(Vectorizer):
         self.descriptions = {}
         self.concept_sims = {}
 
+        self.stops = stopwords('english')
+
 
     def vectorize(self, docs):
         """
@@ -87,9 +86,9 @@ class DCSVectorizer(Vectorizer):
         Applies DCS to a document to extract its core concepts and their weights.
         """
         # Prep
-        doc = doc.lower()
-        tagged_tokens = [(t, penn_to_wordnet(t.tag_)) for t in spacy(doc, tag=True, parse=False, entity=False)]
-        tokens = [t for t, tag in tagged_tokens]
+        doc = annotate(doc)
+        tagged_tokens = [(t, penn_to_wordnet(tag)) for t, tag in zip(doc.tokens, doc.tags)]
+        tokens = list(doc.tokens)
         term_concept_map = self._disambiguate_doc(tagged_tokens)
         concept_weights = self._weight_concepts(tokens, term_concept_map)
 
@@ -280,7 +279,7 @@ class DCSVectorizer(Vectorizer):
         """
         all_concepts = []
         doc_core_sems = []
-        for doc in docs:
+        for doc in annotate_docs(docs):
             core_sems = self._process_doc(doc)
             doc_core_sems.append(core_sems)
             all_concepts += [con for con, weight in core_sems]
@@ -386,7 +385,7 @@ class DCSVectorizer(Vectorizer):
             gloss = self._gloss(concept)
             glosses = [self._gloss(rel) for rel in self._related(concept)]
             raw_desc = ' '.join(lemmas + [gloss] + glosses)
-            desc = [w for w in raw_desc.split() if w not in stops]
+            desc = [w for w in raw_desc.split() if w not in self.stops]
             self.descriptions[concept] = desc
         return self.descriptions[concept]
 
@@ -2,8 +2,8 @@
 Runs all keyword extractors and displays their outputs.
 """
 
-from broca.tokenize import keyword, Tokenizer
-tokenizers = {name: cls for name, cls in keyword.__dict__.items() if isinstance(cls, type) and issubclass(cls, Tokenizer)}
+from broca.tokenize import keyword
+tokenizers = {name: getattr(keyword, name) for name in keyword.__all__}
 
 # http://www.nytimes.com/interactive/2015/04/14/dining/field-guide-to-the-sandwich.html
 docs = [
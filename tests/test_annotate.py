@@ -0,0 +1,49 @@
+import pickle
+import unittest
+from broca.annotate import AnnotatedDoc, annotate, annotate_docs
+from broca.entity import Entities, Entity
+from broca.tokenize import LemmaTokenizer
+from broca.tokenize.keyword import POSTokenizer
+
+
+class AnnotateTests(unittest.TestCase):
+    def setUp(self):
+        self.doc = AnnotatedDoc('The cats ran to New York.',
+                                ['the', 'cats', 'ran', 'to', 'new', 'york', '.'],
+                                ['DT', 'NNS', 'VBD', 'TO', 'NNP', 'NNP', '.'],
+                                [('New York', 'GPE')])
+
+    def test_annotated_doc(self):
+        self.assertEqual(self.doc, 'The cats ran to New York.')
+        self.assertIs(annotate(self.doc), self.doc)
+        self.assertIs(annotate_docs([self.doc])[0], self.doc)
+        self.assertEqual(self.doc.lemmas, ('the', 'cat', 'run', 'to', 'new', 'york', '.'))
+
+        doc = pickle.loads(pickle.dumps(self.doc))
+        self.assertIsInstance(doc, AnnotatedDoc)
+        self.assertEqual(doc, self.doc)
+        self.assertEqual(doc.tags, self.doc.tags)
+        self.assertEqual(doc.lemmas, self.doc.lemmas)
+
+    def test_entity(self):
+        # Entities are only recognized when they're needed
+        doc, = annotate_docs(['The cats ran to New York.'])
+        self.assertIsNone(doc.ents)
+        self.assertIs(annotate(doc), doc)
+        self.assertIsNone(pickle.loads(pickle.dumps(doc)).ents)
+
+        doc_ = annotate(doc, entity=True)
+        self.assertIsNotNone(doc_.ents)
+        self.assertEqual(doc_.tokens, doc.tokens)
+        self.assertIs(annotate_docs([doc_], entity=True)[0], doc_)
+
+    def test_consumers(self):
+        # Annotated docs aren't re-parsed
+        self.assertEqual(Entities()([self.doc]), [[Entity('New York', 'GPE')]])
+        self.assertEqual(LemmaTokenizer().tokenize([self.doc]), [['cat', 'run', 'new', 'york', '.']])
+        self.assertEqual(set(POSTokenizer().tokenize([self.doc])[0]), {'new york', 'cats'})
+
+    def test_annotate(self):
+        docs = ['This cat dog is running happy.', 'This cat dog runs sad.']
+        expected = LemmaTokenizer().tokenize(docs)
+        self.assertEqual(LemmaTokenizer().tokenize([annotate(d) for d in docs]), expected)
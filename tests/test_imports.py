@@ -0,0 +1,29 @@
+import sys
+import unittest
+import subprocess
+
+
+class ImportTests(unittest.TestCase):
+    heavy = ['spacy', 'sklearn', 'nltk', 'gensim', 'eatiht', 'scipy', 'joblib']
+
+    def imported(self, code):
+        # Run in a fresh interpreter so modules imported by other tests don't count
+        code = '{}\nimport sys\nprint(" ".join(sys.modules))'.format(code)
+        out = subprocess.check_output([sys.executable, '-c', code]).decode('utf-8')
+        return set(m.split('.')[0] for m in out.split())
+
+    def test_import_is_light(self):
+        modules = self.imported('\n'.join([
+            'import broca',
+            'from broca.preprocess import BasicCleaner',
+            'from broca.distance.sift4 import sift4',
+            'from broca.tokenize import keyword',
+            'from broca import vectorize, similarity, knowledge'
+        ]))
+        for mod in self.heavy:
+            self.assertNotIn(mod, modules)
+
+    def test_lazy_members(self):
+        modules = self.imported('from broca.tokenize.keyword import RAKETokenizer')
+        self.assertIn('broca', modules)
+        self.assertNotIn('spacy', modules)
@@ -0,0 +1,258 @@
+import os
+import json
+import math
+import shutil
+import pickle
+import tempfile
+import random
+import numpy as np
+import unittest
+from unittest import mock
+from collections import Counter
+from broca.knowledge import idf, tf, counts, corpus
+from broca.knowledge.sketch import CountMinSketch
+
+
+class IDFTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.model = {'cat': math.log(4/3), 'dog': math.log(4/2), 'café au lait': math.log(4/1), '_n_docs': 4}
+
+        self.json_path = os.path.join(self.dir, 'idf.json')
+        with open(self.json_path, 'w') as f:
+            json.dump(self.model, f)
+        self.bin_path = os.path.join(self.dir, 'idf.bin')
+        idf.save_idf(self.model, self.bin_path)
+
+    def test_formats_match(self):
+        terms = ['cat', 'dog', 'café au lait', 'bird', '']
+        for path in [self.json_path, self.bin_path]:
+            model = idf.IDF(path)
+            for term in terms:
+                expected = self.model.get(term, math.log(5))
+                self.assertAlmostEqual(model[term], expected, places=6)
+                self.assertEqual(term in model, term in self.model)
+            self.assertEqual(list(model.lookup(terms)), [model[t] for t in terms])
+
+    def test_hash_collisions(self):
+        # Everything collides
+        with mock.patch.object(idf, 'term_hash', lambda term: 42):
+            idf.save_idf(self.model, self.bin_path)
+            model = idf.IDF(self.bin_path)
+            self.assertAlmostEqual(model['dog'], self.model['dog'], places=6)
+            self.assertAlmostEqual(model['bird'], math.log(5))
+            self.assertNotIn('bird', model)
+            self.assertEqual(list(model.lookup(['cat', 'bird'])), [model['cat'], model['bird']])
+
+    def test_pickle(self):
+        model = pickle.loads(pickle.dumps(idf.IDF(self.bin_path)))
+        self.assertAlmostEqual(model['cat'], self.model['cat'], places=6)
+
+    def test_train_binary(self):
+        path = os.path.join(self.dir, 'trained.bin')
+        docs = [['cat', 'dog'], ['cat'], ['cat', 'cat'], ['bird']]
+        trained = idf.train_idf(docs, out=path, binary=True)
+        model = idf.IDF(path)
+        self.assertEqual(model.n_docs, 4)
+        for term in ['cat', 'dog', 'bird']:
+            self.assertAlmostEqual(model[term], trained[term], places=6)
+
+    def test_update(self):
+        random.seed(0)
+        vocab = ['term{}'.format(i) for i in range(50)]
+        docs = [[random.choice(vocab) for _ in range(random.randint(0, 10))] for _ in range(60)]
+        expected = idf.train_idf(docs, n_jobs=1)
+        terms = vocab + ['bird']
+
+        for binary in [False, True]:
+            path = os.path.join(self.dir, 'update')
+            idf.train_idf(docs[:20], out=path, binary=binary, n_jobs=1)
+            model = idf.IDF(path).update(docs[20:40], n_jobs=1).update(docs[40:], n_jobs=1)
+            self.assertEqual(model.n_docs, len(docs))
+            for term in terms:
+                self.assertAlmostEqual(model[term], expected.get(term, math.log(len(docs) + 1)))
+            self.assertTrue(all(abs(model.lookup(terms) - [model[t] for t in terms]) < 1e-6))
+
+            # Updates are kept when pickled, and saved
+            self.assertEqual(pickle.loads(pickle.dumps(model))['term1'], model['term1'])
+            model.save(path, binary=binary)
+            self.assertEqual(idf.IDF(path)['term1'], model['term1'])
+
+
+class CountsTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        random.seed(0)
+        vocab = ['term{}'.format(i) for i in range(500)]
+        self.docs = [[random.choice(vocab) for _ in range(random.randint(0, 20))] for _ in range(300)]
+
+    def expected_dfs(self, docs):
+        return Counter(t for doc in docs for t in set(doc))
+
+    def test_count(self):
+        for kwargs in [{}, {'chunk_size': 7, 'n_jobs': 2}, {'chunk_size': 5, 'n_jobs': 1}]:
+            result = counts.count(iter(self.docs), idf.count_idf, **kwargs)
+            self.assertEqual(result.counts, self.expected_dfs(self.docs))
+            self.assertEqual(result.n_docs, len(self.docs))
+
+    def test_spill(self):
+        result = counts.count(iter(self.docs), idf.count_idf, chunk_size=10, n_jobs=1,
+                              max_terms=50, spill_dir=self.dir)
+
+        # The merged counts are streamed from disk until they're needed in memory
+        expected = self.expected_dfs(self.docs)
+        self.assertEqual(len(result), len(expected))
+        self.assertEqual(list(result.items()), sorted(expected.items()))
+        self.assertEqual(result.counts, expected)
+
+        spilled = idf.train_idf(self.docs, n_jobs=1, max_terms=50, spill_dir=self.dir)
+        self.assertEqual(spilled, idf.train_idf(self.docs, n_jobs=1))
+
+        # Spilled runs are cleaned up
+        self.assertEqual(os.listdir(self.dir), [])
+
+    def test_incremental(self):
+        path = os.path.join(self.dir, 'dfs.counts')
+        idf.train_idf(self.docs[:100], save_counts=path, n_jobs=1)
+        trained = idf.train_idf(self.docs[100:], counts=path, save_counts=path, n_jobs=1)
+        expected = idf.train_idf(self.docs, n_jobs=1)
+        self.assertEqual(trained, expected)
+
+        saved = counts.Counts.load(path)
+        self.assertEqual(saved.n_docs, len(self.docs))
+        self.assertEqual(saved.counts, self.expected_dfs(self.docs))
+
+    def test_train_tf(self):
+        files = [self.docs[:150], self.docs[150:]]
+        expected = Counter(t for doc in self.docs for t in doc)
+        self.assertEqual(tf.train_tf(files, n_jobs=2), dict(expected))
+
+
+class SketchTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        # Zipfian-ish
+        random.seed(0)
+        self.docs = [['term{}'.format(int(random.paretovariate(1))) for _ in range(20)] for _ in range(500)]
+        self.exact = Counter(t for doc in self.docs for t in doc)
+
+    def test_estimates(self):
+        sketch = CountMinSketch(epsilon=0.01, delta=0.01, k=5)
+        for doc in self.docs:
+            sketch.add(Counter(doc))
+
+        bound = 0.01 * sum(self.exact.values())
+        terms = list(self.exact)
+        for term, estimate in zip(terms, sketch.lookup(terms)):
+            self.assertGreaterEqual(estimate, self.exact[term])
+            self.assertLessEqual(estimate - self.exact[term], bound)
+        self.assertEqual([t for t, _ in sketch.most_common()], [t for t, _ in self.exact.most_common(5)])
+
+    def test_merge(self):
+        a, b, both = [CountMinSketch(epsilon=0.01, k=5) for _ in range(3)]
+        for i, doc in enumerate(self.docs):
+            (a if i % 2 else b).add(Counter(doc))
+            both.add(Counter(doc))
+
+        path = os.path.join(self.dir, 'b.sketch')
+        b.save(path)
+        self.assertEqual(os.listdir(self.dir), ['b.sketch'])
+        a.update(path)
+        self.assertTrue((a.table == both.table).all())
+        self.assertEqual(a.most_common(), both.most_common())
+        self.assertRaises(Exception, a.update, CountMinSketch(epsilon=0.1))
+
+    def test_train(self):
+        path = os.path.join(self.dir, 'idf.sketch')
+        sketch = idf.train_idf(self.docs, out=path, n_jobs=2, sketch=CountMinSketch(epsilon=0.001))
+        self.assertEqual(sketch.n_docs, len(self.docs))
+
+        exact = idf.train_idf(self.docs, n_jobs=1)
+        model = idf.IDF(path)
+        terms = list(self.exact) + ['bird']
+        for term, value in zip(terms, model.lookup(terms)):
+            # Document frequencies are overestimated, if anything
+            self.assertLessEqual(model[term], exact.get(term, math.log(len(self.docs) + 1)) + 1e-9)
+            self.assertAlmostEqual(value, model[term], places=5)
+
+        tfs = tf.train_tf([self.docs], sketch=CountMinSketch(epsilon=0.001, k=3))
+        self.assertEqual(tfs.most_common(1)[0][0], self.exact.most_common(1)[0][0])
+
+        # Sketches are added to by passing them in, not as counts
+        counts_path = os.path.join(self.dir, 'dfs.counts')
+        for train in [idf.train_idf, tf.train_tf]:
+            self.assertRaises(Exception, train, [self.docs], sketch=CountMinSketch(epsilon=0.01), counts=path)
+            self.assertRaises(Exception, train, [self.docs], sketch=CountMinSketch(epsilon=0.01), save_counts=counts_path)
+        self.assertFalse(os.path.exists(counts_path))
+        sketch = idf.train_idf(self.docs, n_jobs=1, sketch=CountMinSketch.load(path))
+        self.assertEqual(sketch.n_docs, 2*len(self.docs))
+
+
+class CorpusTest(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+
+        random.seed(0)
+        vocab = ['cat', 'dog', 'Bird', 'café', 'hat']
+        self.paths = []
+        self.lines = []
+        for i in range(2):
+            path = os.path.join(self.dir, 'docs.{}.txt'.format(i))
+            lines = [' '.join(random.choice(vocab) for _ in range(random.randint(0, 8))) for _ in range(50)]
+            with open(path, 'w') as f:
+                f.write('\n'.join(lines))
+            self.paths.append(path)
+            self.lines.extend(lines)
+        self.corpus_dir = os.path.join(self.dir, 'corpus')
+
+    def ingest(self, **kwargs):
+        return corpus.ingest(self.paths, self.corpus_dir, tokenizer=str.split, sentences=False,
+                             part_size=64, n_jobs=2, **kwargs)
+
+    def test_ingest(self):
+        c = self.ingest()
+        expected = [line.lower().split() for line in self.lines]
+        self.assertEqual(list(c), expected)
+        self.assertEqual(list(c), expected)
+        self.assertEqual(len(c), len(self.lines))
+        self.assertEqual([i for i, _ in c.labeled()], list(range(1, len(self.lines) + 1)))
+
+    def test_vocab_size(self):
+        # A single long token doesn't pad the rest of the vocabulary
+        with open(self.paths[0], 'a') as f:
+            f.write('\ncat dog café ' + 'x' * 10000)
+        c = self.ingest()
+        self.assertEqual(list(c)[50], ['cat', 'dog', 'café', 'x' * 10000])
+
+        size = 0
+        for p in os.listdir(self.corpus_dir):
+            if p.startswith('part.'):
+                with np.load(os.path.join(self.corpus_dir, p)) as part:
+                    size += part['vocab'].nbytes
+        self.assertLess(size, 20000)
+
+    def test_resume(self):
+        self.ingest()
+        parts = sorted(p for p in os.listdir(self.corpus_dir) if p.startswith('part.'))
+        mtimes = {p: os.path.getmtime(os.path.join(self.corpus_dir, p)) for p in parts}
+
+        # As if interrupted
+        os.remove(os.path.join(self.corpus_dir, parts[3]))
+        self.assertRaises(Exception, corpus.Corpus, self.corpus_dir)
+
+        c = self.ingest()
+        self.assertEqual(list(c), [line.lower().split() for line in self.lines])
+        for p in parts:
+            if p != parts[3]:
+                self.assertEqual(os.path.getmtime(os.path.join(self.corpus_dir, p)), mtimes[p])
+
+        # Other settings
+        self.assertRaises(Exception, self.ingest, lowercase=False)
+        c = self.ingest(lowercase=False, refresh=True)
+        self.assertEqual(list(c), [line.split() for line in self.lines])
@@ -1,9 +1,52 @@
+import os
+import json
+import time
+import shutil
+import pickle
 import unittest
+import tempfile
+import threading
+import numpy as np
+import scipy.sparse as sps
 from broca import Pipe, Pipeline
+from broca.pipeline import executor
+from broca.pipeline.profile import Profiler
+from broca.pipeline.cryo import Cryo, digest
+from broca.pipeline.storage import MemoryStorage, LocalStorage, TieredStorage
 from broca.preprocess import BasicCleaner, HTMLCleaner
 from broca.tokenize.keyword import OverkillTokenizer, RAKETokenizer
 
 
+# Pipes for tests which send them to worker processes,
+# so they need to be importable
+class PlusOne(Pipe):
+    input = Pipe.type.vals
+    output = Pipe.type.vals
+    def __call__(self, vals):
+        return [v+1 for v in vals]
+
+
+class PlusTwo(Pipe):
+    input = Pipe.type.vals
+    output = Pipe.type.vals
+    def __call__(self, vals):
+        return [v+2 for v in vals]
+
+
+class PlusThree(Pipe):
+    input = Pipe.type.vals
+    output = Pipe.type.vals
+    def __call__(self, vals):
+        return [v+3 for v in vals]
+
+
+class Sum(Pipe):
+    input = (Pipe.type.vals, Pipe.type.vals, Pipe.type.vals)
+    output = Pipe.type.vals
+    def __call__(self, vals1, vals2, vals3):
+        return [sum([v1,v2,v3]) for v1,v2,v3 in zip(vals1,vals2,vals3)]
+
+
 class PipelineTests(unittest.TestCase):
     def setUp(self):
         self.docs = [
@@ -415,3 +458,467 @@ class PipelineTests(unittest.TestCase):
 
         out = p([1,2,3,4])
         self.assertEqual(out, [24,27,30,33])
+
+
+    def test_multi_pipeline_shared_prefix(self):
+        calls = []
+
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                calls.append('A')
+                return [v+1 for v in vals]
+
+        class B(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                calls.append('B')
+                return [v+2 for v in vals]
+
+        class C(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                calls.append('C')
+                return [v+3 for v in vals]
+
+        p = Pipeline(A(), [B(), C()], [B(), C()], freeze=False)
+        out = p([1,2,3])
+        self.assertEqual(out, ([6,7,8], [7,8,9], [7,8,9], [8,9,10]))
+        self.assertEqual(calls.count('A'), 1)
+        self.assertEqual(calls.count('B'), 3)
+        self.assertEqual(calls.count('C'), 3)
+
+        # Nested pipelines' steps are shared too
+        calls[:] = []
+        a = A()
+        p = Pipeline(Pipeline(a, B(), freeze=False), [B(), C()], freeze=False)
+        out = p([1,2,3])
+        self.assertEqual(out, ([6,7,8], [7,8,9]))
+        self.assertEqual(calls, ['A', 'B', 'B', 'C'])
+
+        calls[:] = []
+        p = Pipeline(A(), [B(), C()], freeze=False, share_prefixes=False)
+        self.assertEqual(p([1,2,3]), ([4,5,6], [5,6,7]))
+        self.assertEqual(calls.count('A'), 2)
+
+        # Pipes which modify their input in place don't affect other branches
+        class Vec(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                return np.array(vals, dtype=float)
+
+        class Norm(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                vals /= vals.max()
+                return vals
+
+        class Scale(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                return vals * 2
+
+        vec = Vec()
+        for share_prefixes in [True, False]:
+            p = Pipeline(vec, [Norm(), Scale()], freeze=False, share_prefixes=share_prefixes)
+            normed, scaled = p([1,2,3])
+            np.testing.assert_array_almost_equal(normed, [1/3, 2/3, 1])
+            np.testing.assert_array_equal(scaled, [2, 4, 6])
+            p = Pipeline([Pipeline(vec, Norm()), vec], freeze=False, share_prefixes=share_prefixes)
+            normed, vecs = p([1,2,3])
+            np.testing.assert_array_equal(vecs, [1, 2, 3])
+
+    def test_parallel_executor(self):
+        A, B, C, E = PlusOne, PlusTwo, PlusThree, Sum
+        for executor in ['thread', 'process']:
+            for freeze in [True, False]:
+                # Refreshed, so frozen steps are computed (and their keys locked) each time
+                p = Pipeline(A(), (A(), B(), C()), E(), executor=executor, max_workers=4,
+                             freeze=freeze, refresh=True)
+                self.assertEqual(p([1,2,3]), [12,15,18])
+
+                for share_prefixes in [True, False]:
+                    p = Pipeline(A(), [A(), B(), C()], [A(), B()],
+                                 executor=executor, max_workers=4, freeze=freeze,
+                                 refresh=True, share_prefixes=share_prefixes)
+                    self.assertEqual(p([1,2,3]), ([4,5,6], [5,6,7], [5,6,7], [6,7,8], [6,7,8], [7,8,9]))
+
+        self.assertRaises(ValueError, Pipeline(A(), (A(), B()), executor='foo', max_workers=2), [1])
+
+    def test_executor_budget(self):
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+
+        self.assertEqual(executor.n_workers([A(), A()], max_workers=8), 8)
+        self.assertEqual(executor.n_workers([A(n_jobs=2), A(n_jobs=4)], max_workers=8), 2)
+        self.assertEqual(executor.n_workers([A(n_jobs=16)], max_workers=8), 1)
+
+    def test_stream(self):
+        chunks = []
+
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            per_doc = True
+            def __call__(self, vals):
+                chunks.append(len(vals))
+                return [v+1 for v in vals]
+
+        class B(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            per_doc = True
+            def __call__(self, vals):
+                return [v+2 for v in vals]
+
+        class Norm(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                return [v/max(vals) for v in vals]
+
+        class E(Pipe):
+            input = (Pipe.type.vals, Pipe.type.vals)
+            output = Pipe.type.vals
+            per_doc = True
+            def __call__(self, vals1, vals2):
+                return [v1+v2 for v1, v2 in zip(vals1, vals2)]
+
+        docs = (i for i in range(10))
+        p = Pipeline(A(), B(), freeze=False, chunk_size=4)
+        out = p.stream(docs)
+
+        # Nothing is computed until the output is consumed
+        self.assertEqual(chunks, [])
+        self.assertEqual(list(out), [i+3 for i in range(10)])
+        self.assertEqual(chunks, [4, 4, 2])
+
+        # Materializes at pipes which need the whole corpus
+        p = Pipeline(A(), Norm(), (A(), B()), E(), chunk_size=3)
+        out = p.stream(iter(range(9)))
+        self.assertEqual(list(out), p(list(range(9))))
+
+        p = Pipeline(A(), (A(), B()), freeze=False, chunk_size=3)
+        self.assertEqual(list(p.stream(range(3))), [(2,3), (3,4), (4,5)])
+
+        p = Pipeline(A(), Norm(), chunk_size=3)
+        self.assertEqual(p.stream(range(3)), [1/3, 2/3, 1.])
+
+    def test_profile(self):
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                return [v+1 for v in vals]
+
+        records = []
+        profiler = Profiler(hooks=[records.append])
+        p = Pipeline(A(), (A(), A()), profiler=profiler, refresh=True)
+        p([1,2,3])
+        self.assertEqual(len(profiler.records), 3)
+        self.assertEqual(records, profiler.records)
+        self.assertEqual([r['cache'] for r in records], ['miss', 'miss', 'miss'])
+        self.assertEqual(records[0]['input_size'], [3])
+        self.assertEqual(records[0]['output_size'], 3)
+
+        profiler.reset()
+        p = Pipeline(A(), (A(), A()), profiler=profiler)
+        p([1,2,3])
+        self.assertEqual([r['cache'] for r in profiler.records], ['hit', 'hit', 'hit'])
+        self.assertEqual(len(json.loads(profiler.to_json())), 3)
+        self.assertEqual(len(profiler.table().split('\n')), 4)
+
+class CryoTests(unittest.TestCase):
+    def test_digest(self):
+        arr = np.arange(12, dtype=np.float64).reshape(3, 4)
+        self.assertEqual(digest(arr), digest(arr.copy()))
+        self.assertNotEqual(digest(arr), digest(arr.reshape(4, 3)))
+        self.assertNotEqual(digest(arr), digest(arr.astype(np.float32)))
+
+        mat = sps.csr_matrix(arr)
+        self.assertEqual(digest(mat), digest(mat.tocoo()))
+        self.assertNotEqual(digest(mat), digest(arr))
+
+        self.assertEqual(digest(['a', 'b']), digest(['a', 'b']))
+        self.assertNotEqual(digest(['ab']), digest(['a', 'b']))
+        self.assertNotEqual(digest(['a', 'b']), digest(('a', 'b')))
+        self.assertEqual(digest({'a': 1, 'b': 2}), digest({'b': 2, 'a': 1}))
+
+    def test_freeze_digest(self):
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                return [v+1 for v in vals]
+
+        cryo = Cryo(refresh=True)
+        out, dig = cryo.freeze(A(), ([1,2,3],))
+        self.assertEqual(dig, digest(out))
+
+        # Passing the digest in is equivalent to hashing the input
+        cryo = Cryo()
+        out_, dig_ = cryo.freeze(A(), ([1,2,3],), digests=(digest([1,2,3]),))
+        self.assertEqual(out, out_)
+        self.assertEqual(dig, dig_)
+
+    def test_local_storage_eviction(self):
+        path = tempfile.mkdtemp()
+        try:
+            storage = LocalStorage(path, max_bytes=1)
+            storage.put('a/x', [1,2,3], 'abc')
+            self.assertNotIn('a/x', storage)
+
+            storage = LocalStorage(path)
+            storage.put('a/x', [1,2,3], 'abc')
+            storage.put('a/y', [4,5,6], 'def')
+            storage.put('a/z', [7,8,9], 'ghi')
+            self.assertEqual(storage.get('a/x'), ([1,2,3], 'abc'))
+
+            # Keep room for two entries; 'y' is the least recently used
+            storage.max_bytes = storage.size() - 1
+            storage.evict()
+            self.assertIn('a/x', storage)
+            self.assertNotIn('a/y', storage)
+            self.assertIn('a/z', storage)
+        finally:
+            shutil.rmtree(path)
+
+    def test_tiered_storage(self):
+        path = tempfile.mkdtemp()
+        try:
+            mem = MemoryStorage(max_items=1)
+            storage = TieredStorage(mem, LocalStorage(path))
+            storage.put('a/x', [1,2,3], 'abc')
+            storage.put('a/y', [4,5,6], 'def')
+            self.assertNotIn('a/x', mem)
+            self.assertEqual(storage.get('a/x'), ([1,2,3], 'abc'))
+
+            # Promoted to the memory tier
+            self.assertIn('a/x', mem)
+
+            # Thawed results are copies
+            result, _ = storage.get('a/x')
+            result.append(4)
+            self.assertEqual(storage.get('a/x'), ([1,2,3], 'abc'))
+
+            # Bounded by bytes
+            mem = MemoryStorage(max_bytes=2000)
+            mem.put('a/x', np.zeros(100), 'abc')
+            mem.put_docs('a/y', {'d1': (np.zeros(100), 'def')})
+            self.assertLessEqual(mem.size(), 2000)
+            mem.put('a/z', np.zeros(100), 'ghi')
+            self.assertLessEqual(mem.size(), 2000)
+            self.assertNotIn('a/x', mem)
+            self.assertIn('a/z', mem)
+            self.assertEqual(list(mem.get_docs('a/y', ['d1'])), ['d1'])
+        finally:
+            shutil.rmtree(path)
+
+    def test_local_storage_mmap(self):
+        path = tempfile.mkdtemp()
+        try:
+            storage = LocalStorage(path)
+            arr = np.arange(12, dtype=np.float64).reshape(3, 4)
+            mat = sps.csr_matrix(arr)
+
+            storage.put('a/x', arr, 'abc')
+            result, _ = storage.get('a/x')
+            self.assertIsInstance(result, np.memmap)
+            np.testing.assert_array_equal(result, arr)
+
+            # Thawed results can be modified in place, as when they're computed,
+            # without changing what's stored
+            result /= result.max()
+            np.testing.assert_array_equal(storage.get('a/x')[0], arr)
+
+            storage.put('a/y', mat, 'def')
+            result, _ = storage.get('a/y')
+            self.assertEqual(result.format, 'csr')
+            np.testing.assert_array_equal(result.toarray(), arr)
+            result.data *= 2
+            np.testing.assert_array_equal(storage.get('a/y')[0].toarray(), arr)
+        finally:
+            shutil.rmtree(path)
+
+
+    def test_per_doc_freeze(self):
+        calls = []
+
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            per_doc = True
+            def __call__(self, vals):
+                calls.append(list(vals))
+                return [v+1 for v in vals]
+
+        class B(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            per_doc = True
+            def __call__(self, vals):
+                calls.append(list(vals))
+                return [v*2 for v in vals]
+
+        path = tempfile.mkdtemp()
+        try:
+            storage = LocalStorage(path)
+            p = Pipeline(A(), B(), storage=storage)
+            self.assertEqual(p([1,2,3]), [4,6,8])
+            self.assertEqual(calls, [[1,2,3], [2,3,4]])
+
+            # Only new documents are processed
+            calls[:] = []
+            self.assertEqual(p([3,1,2,3,4]), [8,4,6,8,10])
+            self.assertEqual(calls, [[4], [5]])
+
+            calls[:] = []
+            p = Pipeline(A(), B(), storage=storage, refresh=True)
+            self.assertEqual(p([1,2]), [4,6])
+            self.assertEqual(calls, [[1,2], [2,3]])
+        finally:
+            shutil.rmtree(path)
+
+    def test_per_doc_storage(self):
+        path = tempfile.mkdtemp()
+        try:
+            # Per-document results count against `max_bytes`
+            local = LocalStorage(path)
+            local.put_docs('a/x', {'d1': ([1,2,3], 'abc'), 'd2': ([4,5,6], 'def')})
+            size = local.size()
+            self.assertGreater(size, 0)
+            local.put_docs('a/x', {'d1': ([1,2,3], 'abc')})
+            self.assertEqual(local.size(), size)
+            local.put_docs('a/y', {'d1': ([1,2,3], 'abc'), 'd2': ([4,5,6], 'def')})
+            self.assertEqual(local.size(), 2*size)
+
+            # 'a/x' is the least recently used
+            local.get_docs('a/y', ['d1'])
+            local.max_bytes = 2*size - 1
+            local.evict()
+            self.assertEqual(local.get_docs('a/x', ['d1', 'd2']), {})
+            self.assertEqual(local.get_docs('a/y', ['d2']), {'d2': ([4,5,6], 'def')})
+            self.assertEqual([key for key, meta in local.entries()], ['a/y'])
+
+            # Hot documents are served from the memory tier
+            mem = MemoryStorage(max_docs=2)
+            storage = TieredStorage(mem, LocalStorage(path))
+            storage.put_docs('a/z', {'d1': ([1], 'a'), 'd2': ([2], 'b'), 'd3': ([3], 'c')})
+            self.assertEqual(mem.get_docs('a/z', ['d1', 'd2', 'd3']), {'d2': ([2], 'b'), 'd3': ([3], 'c')})
+            self.assertEqual(storage.get_docs('a/z', ['d1', 'd3']), {'d1': ([1], 'a'), 'd3': ([3], 'c')})
+            self.assertEqual(mem.get_docs('a/z', ['d1']), {'d1': ([1], 'a')})
+        finally:
+            shutil.rmtree(path)
+
+    def test_local_storage_corruption(self):
+        path = tempfile.mkdtemp()
+        try:
+            storage = LocalStorage(path)
+            storage.put('a/x', [1,2,3], 'abc')
+            storage.put('a/x', [4,5,6], 'def')
+            self.assertEqual(storage.get('a/x'), ([4,5,6], 'def'))
+            self.assertEqual([key for key, meta in storage.entries()], ['a/x'])
+
+            # A truncated entry is dropped
+            with open(os.path.join(path, 'a/x/result.pkl'), 'r+b') as f:
+                f.truncate(10)
+            self.assertRaises(KeyError, storage.get, 'a/x')
+            self.assertNotIn('a/x', storage)
+
+            # ...and recomputed
+            class A(Pipe):
+                input = Pipe.type.vals
+                output = Pipe.type.vals
+                def __call__(self, vals):
+                    return [v+1 for v in vals]
+
+            cryo = Cryo(storage=storage)
+            out, _ = cryo.freeze(A(), ([1,2,3],))
+            key, = [key for key, meta in storage.entries()]
+            with open(os.path.join(path, key, 'result.pkl'), 'wb') as f:
+                f.write(b'garbage')
+            stats = {}
+            self.assertEqual(cryo.freeze(A(), ([1,2,3],), stats=stats)[0], out)
+            self.assertEqual(stats['cache'], 'miss')
+        finally:
+            shutil.rmtree(path)
+
+    def test_storage_pickle(self):
+        # Storage is sent to worker processes along with the pipeline,
+        # so it must stay picklable once keys have been locked
+        path = tempfile.mkdtemp()
+        try:
+            for storage in [MemoryStorage(), LocalStorage(path), TieredStorage(MemoryStorage(), LocalStorage(path))]:
+                with storage.lock('a/x'):
+                    storage.put('a/x', [1,2,3], 'abc')
+                copy = pickle.loads(pickle.dumps(storage))
+                self.assertEqual(copy.get('a/x'), ([1,2,3], 'abc'))
+                with copy.lock('a/x'):
+                    pass
+        finally:
+            shutil.rmtree(path)
+
+    def test_freeze_lock(self):
+        calls = []
+
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            def __call__(self, vals):
+                calls.append(vals)
+                time.sleep(0.2)
+                return [v+1 for v in vals]
+
+        path = tempfile.mkdtemp()
+        try:
+            # Separate Cryos sharing a directory, like separate processes
+            results = []
+            def run():
+                cryo = Cryo(storage=LocalStorage(path))
+                results.append(cryo(A(), [1,2,3]))
+            threads = [threading.Thread(target=run) for _ in range(3)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(results, [[2,3,4]]*3)
+            self.assertEqual(len(calls), 1)
+        finally:
+            shutil.rmtree(path)
+
+    def test_freeze_docs_lock(self):
+        calls = []
+
+        class A(Pipe):
+            input = Pipe.type.vals
+            output = Pipe.type.vals
+            per_doc = True
+            def __call__(self, vals):
+                calls.append(vals)
+                time.sleep(0.2)
+                return [v+1 for v in vals]
+
+        path = tempfile.mkdtemp()
+        try:
+            # Overlapping documents are only computed once
+            results = []
+            def run(vals):
+                cryo = Cryo(storage=LocalStorage(path))
+                results.append(cryo(A(), vals))
+            threads = [threading.Thread(target=run, args=(vals,))
+                       for vals in ([1,2,3], [1,2,3], [2,3,4])]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(sorted(results), [[2,3,4], [2,3,4], [3,4,5]])
+            self.assertEqual(sorted(v for vals in calls for v in vals), [1,2,3,4])
+        finally:
+            shutil.rmtree(path)
@@ -1,5 +1,13 @@
+import os
+import re
+import random
+import shutil
+import tempfile
 import unittest
+from itertools import combinations
 from broca.tokenize import keyword, util, LemmaTokenizer
+from broca.tokenize.keyword import pos, rake, apriori
+from broca.common.lemma import LemmaCache
 
 
 class KeywordTokenizeTests(unittest.TestCase):
@@ -19,6 +27,27 @@ class KeywordTokenizeTests(unittest.TestCase):
                                            threshold=0.1).tokenize(self.docs)
         self.assertEqual(t_docs, expected_t_docs)
 
+    def test_overkill_streaming(self):
+        expected_t_docs = [
+            ['cat dog', 'run', 'happy'],
+            ['cat dog', 'run', 'sad']
+        ]
+        model_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, model_path)
+
+        # Trains across chunks and saves the phrase models
+        t_docs = keyword.OverkillTokenizer(lemmatize=True,
+                                           min_count=1,
+                                           threshold=0.1,
+                                           chunk_size=1,
+                                           model_path=model_path).tokenize(self.docs)
+        self.assertEqual(t_docs, expected_t_docs)
+
+        # Loads and applies the saved phrase models
+        t_docs = keyword.OverkillTokenizer(lemmatize=True,
+                                           model_path=model_path).tokenize(self.docs)
+        self.assertEqual(t_docs, expected_t_docs)
+
     def test_rake(self):
         expected_t_docs = [
             ['cat dog', 'running happy'],
@@ -84,6 +113,17 @@ class TokenizeTests(unittest.TestCase):
         t_docs = LemmaTokenizer().tokenize(self.docs)
         self.assertEqual(t_docs, expected_t_docs)
 
+    def test_lemma_cache_parallel(self):
+        dir = tempfile.mkdtemp()
+        try:
+            # Lemmas cached in worker processes are saved too
+            path = os.path.join(dir, 'lemmas.pkl')
+            t_docs = LemmaTokenizer(n_jobs=2, lemma_cache=path).tokenize(self.docs)
+            self.assertEqual(t_docs, LemmaTokenizer().tokenize(self.docs))
+            self.assertGreater(len(LemmaCache(path=path)), 0)
+        finally:
+            shutil.rmtree(dir)
+
     def test_prune(self):
         t_docs = [
             ['cat', 'cat dog', 'happy', 'dog', 'dog'],
@@ -95,3 +135,82 @@ class TokenizeTests(unittest.TestCase):
         ]
         t_docs = util.prune(t_docs)
         self.assertEqual(t_docs, expected_t_docs)
+
+    def test_prune_matches_naive(self):
+        def naive_prune(tdocs):
+            # The original quadratic implementation
+            all_terms = set(t for toks in tdocs for t in toks)
+            phrases = set(t for t in all_terms if len(t.split(' ')) > 1)
+            terms = all_terms - phrases
+            redundant = set(t for t in terms if any(t in ph for ph in phrases))
+            cleared = set()
+            for t in redundant:
+                for d in tdocs:
+                    if t in d and d.count(t) > sum(1 for ph in d if t != ph and t in ph):
+                        cleared.add(t)
+            redundant = redundant - cleared
+            return [[t for t in d if t not in redundant] for d in tdocs]
+
+        # Small vocabularies so terms often contain one another
+        rand = random.Random(0)
+        words = ['a', 'ab', 'b', 'ba', 'cat', 'cats', 'at', 'dog', '']
+        for _ in range(200):
+            tdocs = [[' '.join(rand.choice(words) for _ in range(rand.choice([1, 1, 2, 3])))
+                      for _ in range(rand.randint(0, 8))]
+                     for _ in range(rand.randint(1, 5))]
+            self.assertEqual(util.prune(tdocs), naive_prune(tdocs))
+
+    def test_noun_phrases_match_naive(self):
+        def naive_noun_phrases(tagged_doc):
+            # The original implementation, which rescans after every merge
+            tags = pos._normalize_tags(tagged_doc)
+            merge = True
+            while merge:
+                merge = False
+                for x in range(0, len(tags) - 1):
+                    t1, t2 = tags[x], tags[x + 1]
+                    value = pos.CFG.get((t1[1], t2[1]), '')
+                    if value:
+                        merge = True
+                        tags.pop(x)
+                        tags.pop(x)
+                        tags.insert(x, ('%s %s' % (t1[0], t2[0]), value))
+                        break
+            return [t[0] for t in tags if t[1] in ['NNP', 'NNI']]
+
+        rand = random.Random(0)
+        tags = ['NN', 'NNS', 'NNP', 'NNPS', 'JJ', 'NP', 'NP-TL', 'NN-TL', 'VB', 'DT']
+        for _ in range(500):
+            tagged = [('w{}'.format(i), rand.choice(tags)) for i in range(rand.randint(0, 20))]
+            self.assertEqual(pos.extract_noun_phrases(tagged), naive_noun_phrases(tagged))
+
+    def test_rake_stop_word_regex(self):
+        words = rake.load_stop_words(rake.stops_path)
+        naive = re.compile('|'.join('\\b' + w + '\\b' for w in words), re.IGNORECASE)
+        regex = rake.build_stop_word_regex(rake.stops_path)
+        self.assertIs(rake.build_stop_word_regex(rake.stops_path), regex)
+
+        rand = random.Random(0)
+        pieces = words[:50] + ['cat', 'Dog', "'", "'s", 'A', 'able-bodied', ' ', ' ', ',', '.']
+        for _ in range(200):
+            text = ''.join(rand.choice(pieces) + rand.choice(['', ' ']) for _ in range(20))
+            self.assertEqual(regex.sub('|', text), naive.sub('|', text))
+
+        # Can't be matched as a trie if a prefix comes after a longer word
+        self.assertIsNone(rake._trie_pattern(["a's", 'a']))
+        self.assertIsNotNone(rake._trie_pattern(['a', "a's"]))
+
+    def test_frequent_sets(self):
+        def brute_force(transactions, min_sup):
+            items = sorted(set(i for t in transactions for i in t))
+            return set(c for k in range(1, len(items) + 1) for c in combinations(items, k)
+                       if sum(1 for t in transactions if set(c) <= t)/len(transactions) >= min_sup)
+
+        rand = random.Random(0)
+        items = ['a', 'b', 'c', 'd', 'e', 'f']
+        for _ in range(100):
+            transactions = [set(rand.sample(items, rand.randint(0, 5))) for _ in range(rand.randint(1, 10))]
+            min_sup = rand.choice([0.1, 0.3, 0.5, 0.8])
+            freq_sets = apriori.frequent_sets(transactions, min_sup)
+            self.assertEqual(len(freq_sets), len(set(freq_sets)))
+            self.assertEqual(set(freq_sets), brute_force(transactions, min_sup))
@@ -1,6 +1,12 @@
+import os
+import shutil
 import unittest
+import tempfile
 import numpy as np
 from broca.common import util
+from broca.common.lemma import LemmaCache
+from broca.common.pool import WorkerPool
+from broca.common.stopwords import stopwords_file, stopwords_list
 
 
 class UtilTest(unittest.TestCase):
@@ -19,3 +25,125 @@ class UtilTest(unittest.TestCase):
         sim_mat = util.build_sim_mat(items, sim_func)
         np.testing.assert_array_equal(sim_mat, expected)
 
+
+    def test_stopwords_file(self):
+        stops = stopwords_file()
+        self.assertIsInstance(stops, frozenset)
+        self.assertIn('the', stops)
+        self.assertNotIn('#stop', stops)
+
+        # Loaded once
+        self.assertIs(stopwords_file(), stops)
+
+        # In order, for RAKE's stop word regex
+        words = stopwords_list()
+        self.assertEqual(words[:3], ('a', "a's", 'able'))
+        self.assertEqual(set(words), stops)
+
+
+class LemmaCacheTest(unittest.TestCase):
+    class Lemmatizer():
+        def __init__(self):
+            self.calls = 0
+
+        def lemmatize(self, token, tag):
+            self.calls += 1
+            return token.rstrip('s')
+
+    def test_cache(self):
+        lem = self.Lemmatizer()
+        cache = LemmaCache(max_size=2, lemmatizer=lem)
+        for tok in ['cats', 'dogs', 'cats', 'cats', 'birds', 'cats', 'dogs']:
+            self.assertEqual(cache.lemmatize(tok, 'n'), tok.rstrip('s'))
+
+        # 'dogs' was dropped when 'birds' came in
+        self.assertEqual(lem.calls, 4)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(cache.stats()['hits'], 3)
+        self.assertAlmostEqual(cache.hit_rate, 3/7)
+
+    def test_persistence(self):
+        dir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(dir, 'lemmas.pkl')
+            cache = LemmaCache(path=path, lemmatizer=self.Lemmatizer())
+            cache.lemmatize('cats', 'n')
+            cache.save()
+
+            other = LemmaCache(path=path, lemmatizer=self.Lemmatizer())
+            other.lemmatize('dogs', 'n')
+            other.save()
+
+            lem = self.Lemmatizer()
+            cache = LemmaCache(path=path, lemmatizer=lem)
+            cache.lemmatize('cats', 'n')
+            cache.lemmatize('dogs', 'n')
+            self.assertEqual(lem.calls, 0)
+            self.assertEqual(os.listdir(dir), ['lemmas.pkl'])
+        finally:
+            shutil.rmtree(dir)
+
+    def test_merge(self):
+        # New lemmas are only tracked if asked to
+        cache = LemmaCache(lemmatizer=self.Lemmatizer())
+        cache.lemmatize('cats', 'n')
+        self.assertEqual(cache.drain(), [])
+
+        # As if `worker` were in a worker process
+        worker = LemmaCache(lemmatizer=self.Lemmatizer(), track_new=True)
+        worker.lemmatize('cats', 'n')
+        worker.lemmatize('dogs', 'n')
+        worker.lemmatize('cats', 'n')
+        new = worker.drain()
+        self.assertEqual(new, [(('cats', 'n'), 'cat'), (('dogs', 'n'), 'dog')])
+        self.assertEqual(worker.drain(), [])
+
+        lem = self.Lemmatizer()
+        cache = LemmaCache(lemmatizer=lem)
+        cache.update(new)
+        cache.lemmatize('cats', 'n')
+        cache.lemmatize('dogs', 'n')
+        self.assertEqual(lem.calls, 0)
+
+
+def square(x):
+    return x**2
+
+
+def worker_pid(x):
+    return os.getpid()
+
+
+def die(x):
+    os._exit(1)
+
+
+class WorkerPoolTest(unittest.TestCase):
+    def setUp(self):
+        self.pool = WorkerPool(n_jobs=2)
+        self.addCleanup(self.pool.shutdown)
+
+    def test_map(self):
+        inputs = list(range(101))
+        self.assertEqual(self.pool.map(square, inputs), [x**2 for x in inputs])
+        self.assertEqual(self.pool.map(pow, [(x, 3) for x in inputs], expand_args=True, chunk_size=7),
+                         [x**3 for x in inputs])
+        self.assertEqual(self.pool.map(square, []), [])
+
+    def test_persistent(self):
+        pids = set(self.pool.map(worker_pid, range(20)))
+        self.assertNotIn(os.getpid(), pids)
+
+        # Workers are started on demand, but are kept for later calls
+        for _ in range(3):
+            pids |= set(self.pool.map(worker_pid, range(20)))
+        self.assertLessEqual(len(pids), 2)
+
+    def test_broken(self):
+        # A worker dying breaks the pool for that call, but not later ones
+        from concurrent.futures.process import BrokenProcessPool
+        self.assertRaises(BrokenProcessPool, self.pool.map, die, range(4))
+        self.assertEqual(self.pool.map(square, range(4)), [0, 1, 4, 9])
+
+    def test_unknown_warmup(self):
+        self.assertRaises(Exception, self.pool.map, square, [1, 2], warmup=('foo',))